@@ -0,0 +1,83 @@
+import math
+from constants import SUSPICIOUS_THRESHOLD
+
+class DashboardAggregates:
+    # Running totals for the dashboards, kept current by DataManager's listener
+    # hooks so reading them is O(1) regardless of ledger size. verify()
+    # recomputes everything from the ledger to detect drift.
+    def __init__(self, transactions=(), threshold=SUSPICIOUS_THRESHOLD):
+        self.threshold = threshold
+        self.reset(transactions)
+
+    def reset(self, transactions=()):
+        self.total = 0.0
+        self.count = 0
+        self.suspicious = 0
+        self.per_customer = {}
+        self.per_staff = {}
+        self.staff_counts = {}
+        for txn in transactions:
+            self.on_add(txn)
+
+    def is_suspicious(self, amount):
+        return amount > self.threshold
+
+    def on_add(self, txn):
+        self._apply(txn, txn["amount"], 1)
+
+    def on_update(self, txn, old_amount):
+        self._apply(txn, old_amount, -1)
+        self._apply(txn, txn["amount"], 1)
+
+    def on_delete(self, txn):
+        self._apply(txn, txn["amount"], -1)
+
+    def _apply(self, txn, amount, sign):
+        self.total += sign * amount
+        self.count += sign
+        if self.is_suspicious(amount):
+            self.suspicious += sign
+        cid = txn["customer_id"]
+        self.per_customer[cid] = self.per_customer.get(cid, 0.0) + sign * amount
+        staff = txn.get("staff_username")
+        if staff is not None:
+            self.per_staff[staff] = self.per_staff.get(staff, 0.0) + sign * amount
+            self.staff_counts[staff] = self.staff_counts.get(staff, 0) + sign
+
+    def staff_total(self, username):
+        return self.per_staff.get(username, 0.0)
+
+    def staff_count(self, username):
+        return self.staff_counts.get(username, 0)
+
+    def snapshot(self):
+        return {
+            "total": self.total,
+            "count": self.count,
+            "suspicious": self.suspicious,
+            "per_customer": dict(self.per_customer),
+            "per_staff": dict(self.per_staff),
+            "staff_counts": dict(self.staff_counts),
+        }
+
+    def verify(self, transactions, repair=False):
+        # Returns the fields whose running value differs from a full
+        # recomputation (empty when consistent). Floating point sums are
+        # compared with a relative tolerance.
+        expected = DashboardAggregates(transactions, self.threshold).snapshot()
+        expected["total"] = math.fsum(txn["amount"] for txn in transactions)
+        actual = self.snapshot()
+        drift = {}
+        for field, value in expected.items():
+            if not self._same(actual[field], value):
+                drift[field] = {"running": actual[field], "expected": value}
+        if drift and repair:
+            self.reset(transactions)
+        return drift
+
+    @staticmethod
+    def _same(a, b):
+        if isinstance(a, dict):
+            keys = set(a) | set(b)
+            return all(DashboardAggregates._same(a.get(k, 0), b.get(k, 0)) for k in keys)
+        return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-6)
@@ -1,21 +1,31 @@
 import tkinter as tk
 from tkinter import messagebox, simpledialog, ttk
-import os
-import csv
-import datetime
-import matplotlib.pyplot as plt
-from utils import Utils
-from constants import REPORTS_DIR
+import queue
+from reports import BATCH_REPORTS
+from service import FinSecureService, ServiceError
+from widgets import VirtualTreeview
+from persistence import PersistenceExecutor
+from charts import ChartManager
+import threading
 from tkinter import font as tkfont
 import uuid
 
 class FinSecureApp:
-    def __init__(self, root, role, data_manager, logger, username=None):
+    def __init__(self, root, role, data_manager, logger, username=None, persistence=None,
+                 service=None):
         self.root = root
         self.role = role
         self.data = data_manager
         self.logger = logger
         self.username = username
+        # All changes go through the service; this class only handles the UI
+        self.service = service or FinSecureService(data_manager, logger, username)
+        
+        # Disk writes run on the persistence thread; failures come back here
+        self.persistence = persistence or PersistenceExecutor()
+        self.persistence.attach(self.root)
+        self.persistence.error_handler = lambda e: messagebox.showerror(
+            "Save Failed", f"Changes could not be saved: {e}")
 
         # Initialize ttk Style
         self.style = ttk.Style()
@@ -30,6 +40,10 @@ class FinSecureApp:
         self.highlight_color = "#2980b9"
         self.chart_color = "#3498db"
         self.chart_edge = "#ecf0f1"
+        
+        # Dashboard figures are built once and updated in place on refresh
+        self.charts = ChartManager()
+        self.stat_labels = {}
       
         # Configure styles
         self.style.configure('TFrame', background=self.bg_color)
@@ -63,11 +77,22 @@ class FinSecureApp:
         ttk.Button(self.header_frame, text="Logout", command=self.root.quit,
                   style='TButton').pack(side=tk.RIGHT, padx=10)
         
+        # Pending writes indicator
+        self.pending_label = ttk.Label(self.header_frame, text="")
+        self.pending_label.pack(side=tk.RIGHT, padx=10)
+        self.persistence.add_indicator(
+            lambda pending: self.pending_label.config(text=f"Saving... ({pending})" if pending else ""))
+        
         if role == "admin":
             self.load_admin_dashboard()
         else:
             self.load_staff_dashboard()
 
+    def persist(self):
+        # In-memory state is already updated; the writes are queued in order
+        # and the service only records audit entries once the data write succeeded
+        self.persistence.submit(self.service.commit)
+
     def load_admin_dashboard(self):
         # Main content frame
         content_frame = ttk.Frame(self.root)
@@ -81,27 +106,29 @@ class FinSecureApp:
         card1 = ttk.Frame(stats_frame, style='Card.TFrame')
         card1.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=5)
         ttk.Label(card1, text="TOTAL CUSTOMERS", style='CardHeader.TLabel').pack(pady=(10, 5))
-        ttk.Label(card1, text=str(len(self.data.customers)), style='Stat.TLabel').pack(pady=(0, 10))
+        self.stat_labels["customers"] = ttk.Label(card1, style='Stat.TLabel')
+        self.stat_labels["customers"].pack(pady=(0, 10))
         
         # Card 2: Total Transactions
         card2 = ttk.Frame(stats_frame, style='Card.TFrame')
         card2.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=5)
         ttk.Label(card2, text="TOTAL TRANSACTIONS", style='CardHeader.TLabel').pack(pady=(10, 5))
-        ttk.Label(card2, text=str(len(self.data.transactions)), style='Stat.TLabel').pack(pady=(0, 10))
+        self.stat_labels["count"] = ttk.Label(card2, style='Stat.TLabel')
+        self.stat_labels["count"].pack(pady=(0, 10))
         
         # Card 3: Total Volume
         card3 = ttk.Frame(stats_frame, style='Card.TFrame')
         card3.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=5)
         ttk.Label(card3, text="TOTAL VOLUME", style='CardHeader.TLabel').pack(pady=(10, 5))
-        total_amount = sum(txn["amount"] for txn in self.data.transactions)
-        ttk.Label(card3, text=f"${total_amount:,.2f}", style='Stat.TLabel').pack(pady=(0, 10))
+        self.stat_labels["total"] = ttk.Label(card3, style='Stat.TLabel')
+        self.stat_labels["total"].pack(pady=(0, 10))
         
         # Card 4: Suspicious Activity
         card4 = ttk.Frame(stats_frame, style='Card.TFrame')
         card4.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=5)
         ttk.Label(card4, text="SUSPICIOUS TXNS", style='CardHeader.TLabel').pack(pady=(10, 5))
-        suspicious = len([txn for txn in self.data.transactions if txn["amount"] > 10000])
-        ttk.Label(card4, text=str(suspicious), style='Stat.TLabel').pack(pady=(0, 10))
+        self.stat_labels["suspicious"] = ttk.Label(card4, style='Stat.TLabel')
+        self.stat_labels["suspicious"].pack(pady=(0, 10))
         
         # Charts and actions row
         bottom_frame = ttk.Frame(content_frame)
@@ -112,28 +139,8 @@ class FinSecureApp:
         chart_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(0, 10))
         ttk.Label(chart_frame, text="TRANSACTION DISTRIBUTION", style='CardHeader.TLabel').pack(pady=10)
         
-        amounts = [txn["amount"] for txn in self.data.transactions]
-        if amounts:
-            fig, ax = plt.subplots(figsize=(6, 4), facecolor=self.card_bg)
-            ax.set_facecolor(self.card_bg)
-            
-            # Customize plot
-            bars = ax.hist(amounts, bins=10, color=self.chart_color, edgecolor=self.chart_edge)
-            ax.set_title("Transaction Amount Distribution", color=self.fg_color)
-            ax.set_xlabel("Amount ($)", color=self.fg_color)
-            ax.set_ylabel("Frequency", color=self.fg_color)
-            
-            # Customize ticks and spines
-            ax.tick_params(colors=self.fg_color)
-            for spine in ax.spines.values():
-                spine.set_color('#7f8c8d')
-            
-            from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-            canvas = FigureCanvasTkAgg(fig, master=chart_frame)
-            canvas.draw()
-            canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 10))
-        else:
-            ttk.Label(chart_frame, text="No transactions to visualize").pack()
+        self.chart_frame = chart_frame
+        self.empty_chart_label = ttk.Label(chart_frame, text="No transactions to visualize")
         
         # Right panel - Actions
         action_frame = ttk.Frame(bottom_frame, style='Card.TFrame')
@@ -144,6 +151,7 @@ class FinSecureApp:
             ("➕ Add Customer", self.add_customer),
             ("👥 View Customers", self.view_customers),
             ("📊 Generate Report", self.generate_report),
+            ("🗂️ Batch Reports", self.generate_batch_reports),
             ("📝 Audit Logs", self.view_audit),
             ("💳 Add Transaction", self.add_transaction),
             # ("📈 View Dashboard", self.view_dashboard)
@@ -152,14 +160,60 @@ class FinSecureApp:
         for text, command in actions:
             btn = ttk.Button(action_frame, text=text, command=command, style='TButton')
             btn.pack(fill=tk.X, padx=10, pady=5)
+        
+        self.refresh_dashboard()
+
+    def refresh_dashboard(self):
+        # Called after every change; only the stats and the chart artists are
+        # updated, the widgets and figure are kept
+        if self.role == "admin":
+            self.refresh_admin_dashboard()
+        else:
+            self.refresh_staff_dashboard()
+
+    def show_chart(self, name, has_data):
+        # Returns the panel, creating its figure the first time there is data
+        # to draw; None (with a placeholder shown) while there is none
+        if not has_data:
+            self.empty_chart_label.pack()
+            return None
+        self.empty_chart_label.pack_forget()
+        if name in self.charts.panels:
+            return self.charts.panels[name]
+        panel = self.charts.panel(name, self.chart_frame, facecolor=self.card_bg)
+        panel.ax.tick_params(colors=self.fg_color)
+        for spine in panel.ax.spines.values():
+            spine.set_color('#7f8c8d')
+        panel.widget().pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 10))
+        return panel
+
+    def refresh_admin_dashboard(self):
+        stats = self.service.stats()
+        self.stat_labels["customers"].config(text=str(stats["customers"]))
+        self.stat_labels["count"].config(text=str(stats["count"]))
+        self.stat_labels["total"].config(text=f"${stats['total']:,.2f}")
+        self.stat_labels["suspicious"].config(text=str(stats["suspicious"]))
+        
+        panel = self.show_chart("distribution", stats["count"])
+        if panel is None:
+            return
+        if not panel.draws:
+            panel.ax.set_title("Transaction Amount Distribution", color=self.fg_color)
+            panel.ax.set_xlabel("Amount ($)", color=self.fg_color)
+            panel.ax.set_ylabel("Frequency", color=self.fg_color)
+        histogram = self.data.histogram(bins=10)
+        lefts, widths, counts = histogram.bars()
+        self.charts.update_bars("distribution", lefts, widths, counts, log=histogram.scale == "log",
+                                color=self.chart_color, edgecolor=self.chart_edge)
+        if self.data.histogram_pending():
+            # The bins are being recomputed off the UI thread; redraw when done
+            self.root.after(200, self.refresh_admin_dashboard)
+
     def load_staff_dashboard(self):
     # Main content frame
         content_frame = ttk.Frame(self.root)
         content_frame.pack(fill=tk.BOTH, expand=True, padx=20, pady=(0, 20))
         
-        # Filter transactions for this user only
-        user_txns = [txn for txn in self.data.transactions if txn.get("staff_username") == self.username]
-        
         # Stats cards row
         stats_frame = ttk.Frame(content_frame)
         stats_frame.pack(fill=tk.X, pady=(0, 20))
@@ -168,21 +222,22 @@ class FinSecureApp:
         card1 = ttk.Frame(stats_frame, style='Card.TFrame')
         card1.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=5)
         ttk.Label(card1, text="YOUR TRANSACTIONS", style='CardHeader.TLabel').pack(pady=(10, 5))
-        ttk.Label(card1, text=str(len(user_txns)), style='Stat.TLabel').pack(pady=(0, 10))
+        self.stat_labels["count"] = ttk.Label(card1, style='Stat.TLabel')
+        self.stat_labels["count"].pack(pady=(0, 10))
         
         # Card 2: Total Volume
         card2 = ttk.Frame(stats_frame, style='Card.TFrame')
         card2.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=5)
         ttk.Label(card2, text="YOUR VOLUME", style='CardHeader.TLabel').pack(pady=(10, 5))
-        user_amount = sum(txn["amount"] for txn in user_txns)
-        ttk.Label(card2, text=f"${user_amount:,.2f}", style='Stat.TLabel').pack(pady=(0, 10))
+        self.stat_labels["total"] = ttk.Label(card2, style='Stat.TLabel')
+        self.stat_labels["total"].pack(pady=(0, 10))
         
         # Card 3: Recent Activity
         card3 = ttk.Frame(stats_frame, style='Card.TFrame')
         card3.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=5)
         ttk.Label(card3, text="RECENT ACTIVITY", style='CardHeader.TLabel').pack(pady=(10, 5))
-        recent = len(user_txns[-5:]) if user_txns else 0
-        ttk.Label(card3, text=f"{recent}/5", style='Stat.TLabel').pack(pady=(0, 10))
+        self.stat_labels["recent"] = ttk.Label(card3, style='Stat.TLabel')
+        self.stat_labels["recent"].pack(pady=(0, 10))
         
         # Charts and actions row
         bottom_frame = ttk.Frame(content_frame)
@@ -193,28 +248,8 @@ class FinSecureApp:
         chart_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(0, 10))
         ttk.Label(chart_frame, text="YOUR TRANSACTIONS", style='CardHeader.TLabel').pack(pady=10)
         
-        amounts = [txn["amount"] for txn in user_txns]
-        if amounts:
-            fig, ax = plt.subplots(figsize=(6, 4), facecolor=self.card_bg)
-            ax.set_facecolor(self.card_bg)
-            
-            # Pie chart for staff view
-            amounts_pos = [amt for amt in amounts if amt >= 0]
-            amounts_neg = [abs(amt) for amt in amounts if amt < 0]
-            labels = ['Credits', 'Debits'] if amounts_neg else ['Transactions']
-            sizes = [sum(amounts_pos), sum(amounts_neg)] if amounts_neg else [sum(amounts_pos)]
-            colors = [self.success_color, self.warning_color] if amounts_neg else [self.chart_color]
-            
-            ax.pie(sizes, labels=labels, colors=colors, autopct='%1.1f%%',
-                textprops={'color': self.fg_color}, wedgeprops={'edgecolor': self.chart_edge})
-            ax.set_title("Your Transaction Breakdown", color=self.fg_color)
-            
-            from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-            canvas = FigureCanvasTkAgg(fig, master=chart_frame)
-            canvas.draw()
-            canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 10))
-        else:
-            ttk.Label(chart_frame, text="No transactions to visualize").pack()
+        self.chart_frame = chart_frame
+        self.empty_chart_label = ttk.Label(chart_frame, text="No transactions to visualize")
         
         # Right panel - Actions
         action_frame = ttk.Frame(bottom_frame, style='Card.TFrame')
@@ -231,6 +266,30 @@ class FinSecureApp:
         for text, command in actions:
             btn = ttk.Button(action_frame, text=text, command=command, style='TButton')
             btn.pack(fill=tk.X, padx=10, pady=5)
+        
+        self.refresh_dashboard()
+
+    def refresh_staff_dashboard(self):
+        stats = self.service.stats()
+        user_txns = self.service.my_transactions()
+        self.stat_labels["count"].config(text=str(stats["count"]))
+        self.stat_labels["total"].config(text=f"${stats['total']:,.2f}")
+        self.stat_labels["recent"].config(text=f"{stats['recent']}/5")
+        
+        if self.show_chart("breakdown", user_txns) is None:
+            return
+        # Pie chart for staff view
+        amounts = [txn["amount"] for txn in user_txns]
+        amounts_pos = [amt for amt in amounts if amt >= 0]
+        amounts_neg = [abs(amt) for amt in amounts if amt < 0]
+        labels = ['Credits', 'Debits'] if amounts_neg else ['Transactions']
+        sizes = [sum(amounts_pos), sum(amounts_neg)] if amounts_neg else [sum(amounts_pos)]
+        colors = [self.success_color, self.warning_color] if amounts_neg else [self.chart_color]
+        
+        self.charts.update_pie("breakdown", sizes, labels, colors, title="Your Transaction Breakdown",
+                               autopct='%1.1f%%', textprops={'color': self.fg_color},
+                               wedgeprops={'edgecolor': self.chart_edge})
+
     def add_customer(self):
         dialog = tk.Toplevel(self.root)
         dialog.title("Add New Customer")
@@ -299,38 +358,14 @@ class FinSecureApp:
             username = username_entry.get() if create_staff else None
             password = password_entry.get() if create_staff else None
             
-            # Validate inputs
-            if not all([name, contact]):
-                messagebox.showerror("Error", "Full Name and Contact Info are required")
-                return
-                
-            if create_staff and not all([username, password]):
-                messagebox.showerror("Error", "Username and Password are required for staff accounts")
-                return
-                
-            if create_staff and username in self.data.credentials:
-                messagebox.showerror("Error", "Username already exists")
+            try:
+                self.service.add_customer(name, contact, username, password)
+            except ServiceError as e:
+                messagebox.showerror("Error", str(e))
                 return
-                
-            # Create customer ID
-            cid = str(len(self.data.customers) + 1)
-            
-            # Create customer record
-            self.data.customers[cid] = {
-                "name": name,
-                "contact": Utils.encrypt(contact),
-                "created_at": str(datetime.datetime.now()),
-                "history": [],
-                "is_staff": create_staff,
-                "username": username if create_staff else None
-            }
-            
-            # Create staff credentials if needed
-            if create_staff:
-                self.data.credentials[username] = Utils.encrypt(password)
             
-            self.data.save_all()
-            self.logger.add(f"Customer added: {name}" + (" (staff account)" if create_staff else ""))
+            self.persist()
+            self.refresh_dashboard()
             messagebox.showinfo("Success", f"Customer {name} added successfully!")
             dialog.destroy()
         
@@ -366,29 +401,18 @@ class FinSecureApp:
                       background=[('selected', '#2980b9')],
                       foreground=[('selected', '#ecf0f1')])
         
-        tree_frame = ttk.Frame(win)
-        tree_frame.pack(fill='both', expand=True, padx=10, pady=10)
-        
-        # Treeview scrollbar
-        tree_scroll = ttk.Scrollbar(tree_frame)
-        tree_scroll.pack(side=tk.RIGHT, fill=tk.Y)
-        
-        tree = ttk.Treeview(tree_frame, columns=("ID", "Name", "Contact"), 
-                           show='headings', yscrollcommand=tree_scroll.set)
-        tree.pack(fill='both', expand=True)
+        customers = self.data.customers
         
-        tree_scroll.config(command=tree.yview)
-        
-        tree.heading("ID", text="ID")
-        tree.heading("Name", text="Name")
-        tree.heading("Contact", text="Contact")
+        # Contacts are decrypted only for rows scrolled into view
+        tree = VirtualTreeview(win, columns=("ID", "Name", "Contact"),
+                               keys=list(customers), fetch=self.service.customer_row,
+                               sort_keys={"ID": lambda cid: (len(cid), cid),
+                                          "Name": lambda cid: customers[cid]['name'].lower()})
+        tree.pack(fill='both', expand=True, padx=10, pady=10)
         
         tree.column("ID", width=50, anchor='center')
         tree.column("Name", width=150, anchor='w')
         tree.column("Contact", width=200, anchor='w')
-        
-        for cid, data in self.data.customers.items():
-            tree.insert("", "end", values=(cid, data['name'], Utils.decrypt(data['contact'])))
 # add Transaction method
 
     def add_transaction(self):
@@ -406,31 +430,19 @@ class FinSecureApp:
         amount_entry.grid(row=1, column=1, padx=5, pady=5)
         
         def submit():
-            cid = cid_entry.get()
             try:
-                amount = float(amount_entry.get())
-            except ValueError:
-                messagebox.showerror("Error", "Invalid amount")
+                txn, reasons = self.service.add_transaction(cid_entry.get(), amount_entry.get())
+            except ServiceError as e:
+                messagebox.showerror("Error", str(e))
                 return
-                
-            if cid in self.data.customers and amount:
-                txn = {
-                    "customer_id": cid,
-                    "amount": amount,
-                    "timestamp": str(datetime.datetime.now()),
-                    "staff_username": self.username  # Track which staff member created this
-                }
-                self.data.transactions.append(txn)
-                self.data.customers[cid]["history"].append(txn)
-                self.data.save_all()
-                self.data.save_dashboard()
-                self.logger.add(f"Transaction added for customer {cid}: {amount} by {self.username}")
-                messagebox.showinfo("Transaction", "Transaction recorded")
-                if amount > 10000:
-                    messagebox.showwarning("Alert", "Suspicious transaction detected!")
-                dialog.destroy()
-            else:
-                messagebox.showerror("Error", "Invalid customer ID or amount")
+            
+            self.persist()
+            self.refresh_dashboard()
+            messagebox.showinfo("Transaction", "Transaction recorded")
+            if reasons:
+                messagebox.showwarning("Alert", "Suspicious transaction detected!\n"
+                                       f"Rules triggered: {', '.join(reasons)}")
+            dialog.destroy()
         
     # Rest of the method remains the same...
         
@@ -487,33 +499,23 @@ class FinSecureApp:
                     background=[('selected', '#2980b9')],
                     foreground=[('selected', '#ecf0f1')])
         
-        tree_frame = ttk.Frame(win)
-        tree_frame.pack(fill='both', expand=True, padx=10, pady=10)
+        # Transactions recorded by this user, from the staff index
+        user_txns = {txn["id"]: txn for txn in self.data.transactions_for_staff(self.username)}
         
-        # Treeview scrollbar
-        tree_scroll = ttk.Scrollbar(tree_frame)
-        tree_scroll.pack(side=tk.RIGHT, fill=tk.Y)
-        
-        tree = ttk.Treeview(tree_frame, columns=("Customer", "Amount", "Timestamp"), 
-                        show='headings', yscrollcommand=tree_scroll.set)
-        tree.pack(fill='both', expand=True)
-        
-        tree_scroll.config(command=tree.yview)
+        def fetch(txn_id):
+            txn = user_txns[txn_id]
+            customer_name = self.data.customers.get(txn["customer_id"], {}).get("name", "Unknown")
+            return (customer_name, f"${txn['amount']:,.2f}", txn["timestamp"])
         
-        tree.heading("Customer", text="Customer")
-        tree.heading("Amount", text="Amount")
-        tree.heading("Timestamp", text="Timestamp")
+        tree = VirtualTreeview(win, columns=("Customer", "Amount", "Timestamp"),
+                               keys=list(user_txns), fetch=fetch,
+                               sort_keys={"Amount": lambda txn_id: user_txns[txn_id]["amount"],
+                                          "Timestamp": lambda txn_id: user_txns[txn_id]["timestamp"]})
+        tree.pack(fill='both', expand=True, padx=10, pady=10)
         
         tree.column("Customer", width=150, anchor='w')
         tree.column("Amount", width=150, anchor='e')
         tree.column("Timestamp", width=250, anchor='w')
-        
-        # Filter transactions for this user
-        user_txns = [txn for txn in self.data.transactions if txn.get("staff_username") == self.username]
-        
-        for txn in user_txns:
-            customer_name = self.data.customers.get(txn["customer_id"], {}).get("name", "Unknown")
-            tree.insert("", "end", values=(customer_name, f"${txn['amount']:,.2f}", txn["timestamp"]))
     def show_my_transactions(self, cid):
         win = tk.Toplevel(self.root)
         win.title("My Transactions")
@@ -533,27 +535,20 @@ class FinSecureApp:
                       background=[('selected', '#2980b9')],
                       foreground=[('selected', '#ecf0f1')])
         
-        tree_frame = ttk.Frame(win)
-        tree_frame.pack(fill='both', expand=True, padx=10, pady=10)
-        
-        # Treeview scrollbar
-        tree_scroll = ttk.Scrollbar(tree_frame)
-        tree_scroll.pack(side=tk.RIGHT, fill=tk.Y)
-        
-        tree = ttk.Treeview(tree_frame, columns=("Amount", "Timestamp"), 
-                           show='headings', yscrollcommand=tree_scroll.set)
-        tree.pack(fill='both', expand=True)
+        history = self.data.customers[cid]["txn_ids"]
         
-        tree_scroll.config(command=tree.yview)
+        def fetch(txn_id):
+            txn = self.data.get_transaction(txn_id)
+            return (f"${txn['amount']:,.2f}", txn["timestamp"])
         
-        tree.heading("Amount", text="Amount")
-        tree.heading("Timestamp", text="Timestamp")
+        tree = VirtualTreeview(win, columns=("Amount", "Timestamp"),
+                               keys=list(history), fetch=fetch,
+                               sort_keys={"Amount": lambda txn_id: self.data.get_transaction(txn_id)["amount"],
+                                          "Timestamp": lambda txn_id: self.data.get_transaction(txn_id)["timestamp"]})
+        tree.pack(fill='both', expand=True, padx=10, pady=10)
         
         tree.column("Amount", width=150, anchor='e')
         tree.column("Timestamp", width=250, anchor='w')
-        
-        for txn in self.data.customers[cid]["history"]:
-            tree.insert("", "end", values=(f"${txn['amount']:,.2f}", txn["timestamp"]))
 
     def edit_transaction(self):
         dialog = tk.Toplevel(self.root)
@@ -574,32 +569,16 @@ class FinSecureApp:
         amount_entry.grid(row=2, column=1, padx=5, pady=5)
         
         def submit():
-            cid = cid_entry.get()
-            ts = ts_entry.get()
             try:
-                new_amount = float(amount_entry.get())
-            except ValueError:
-                messagebox.showerror("Error", "Invalid amount")
+                self.service.edit_transaction(cid_entry.get(), ts_entry.get(), amount_entry.get())
+            except ServiceError as e:
+                messagebox.showerror("Error", str(e))
                 return
-                
-            found = False
-            for txn in self.data.transactions:
-                if txn["customer_id"] == cid and txn["timestamp"] == ts:
-                    txn["amount"] = new_amount
-                    found = True
-            
-            if cid in self.data.customers:
-                for txn in self.data.customers[cid].get("history", []):
-                    if txn["timestamp"] == ts:
-                        txn["amount"] = new_amount
-                        found = True
             
-            if found:
-                self.data.save_all()
-                messagebox.showinfo("Success", "Transaction updated")
-                dialog.destroy()
-            else:
-                messagebox.showerror("Error", "Transaction not found")
+            self.persist()
+            self.refresh_dashboard()
+            messagebox.showinfo("Success", "Transaction updated")
+            dialog.destroy()
         
         btn_frame = ttk.Frame(dialog)
         btn_frame.grid(row=3, column=0, columnspan=2, pady=10)
@@ -626,31 +605,16 @@ class FinSecureApp:
         ts_entry.grid(row=1, column=1, padx=5, pady=5)
         
         def submit():
-            cid = cid_entry.get()
-            ts = ts_entry.get()
-            
-            # Delete from transactions list
-            initial_count = len(self.data.transactions)
-            self.data.transactions = [txn for txn in self.data.transactions 
-                                     if not (txn["customer_id"] == cid and txn["timestamp"] == ts)]
-            
-            # Delete from customer history
-            if cid in self.data.customers:
-                initial_history_count = len(self.data.customers[cid].get("history", []))
-                self.data.customers[cid]["history"] = [
-                    txn for txn in self.data.customers[cid].get("history", []) 
-                    if txn["timestamp"] != ts
-                ]
-                final_history_count = len(self.data.customers[cid].get("history", []))
-            else:
-                initial_history_count = final_history_count = 0
+            try:
+                self.service.delete_transaction(cid_entry.get(), ts_entry.get())
+            except ServiceError as e:
+                messagebox.showerror("Error", str(e))
+                return
             
-            if initial_count != len(self.data.transactions) or initial_history_count != final_history_count:
-                self.data.save_all()
-                messagebox.showinfo("Success", "Transaction deleted")
-                dialog.destroy()
-            else:
-                messagebox.showerror("Error", "Transaction not found")
+            self.persist()
+            self.refresh_dashboard()
+            messagebox.showinfo("Success", "Transaction deleted")
+            dialog.destroy()
         
         btn_frame = ttk.Frame(dialog)
         btn_frame.grid(row=2, column=0, columnspan=2, pady=10)
@@ -673,6 +637,17 @@ class FinSecureApp:
         
         ttk.Label(header_frame, text="Audit Logs", style='Header.TLabel').pack()
         
+        # Filter frame; filtering is done by AuditLogger.query, not the widget
+        filter_frame = ttk.Frame(win)
+        filter_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
+        
+        filters = {}
+        for i, label in enumerate(["From", "To", "Username", "Contains"]):
+            ttk.Label(filter_frame, text=label + ":").grid(row=0, column=i * 2, padx=5, sticky='e')
+            entry = ttk.Entry(filter_frame, width=18 if label in ("From", "To") else 14)
+            entry.grid(row=0, column=i * 2 + 1, padx=5)
+            filters[label] = entry
+        
         # Text frame with scrollbar
         text_frame = ttk.Frame(win)
         text_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 10))
@@ -680,7 +655,7 @@ class FinSecureApp:
         text_scroll = ttk.Scrollbar(text_frame)
         text_scroll.pack(side=tk.RIGHT, fill=tk.Y)
         
-        text = tk.Text(text_frame, wrap=tk.WORD, yscrollcommand=text_scroll.set,
+        text = tk.Text(text_frame, wrap=tk.WORD,
                       bg="#34495e", fg="#ecf0f1", insertbackground="#ecf0f1",
                       selectbackground="#3498db", selectforeground="#ecf0f1",
                       font=('Consolas', 10))
@@ -688,34 +663,147 @@ class FinSecureApp:
         
         text_scroll.config(command=text.yview)
         
-        for entry in self.logger.get_log():
-            text.insert(tk.END, f"{entry['timestamp']} - {entry['action']}\n")
+        status = ttk.Label(win, text="")
+        status.pack(pady=(0, 10))
+        
+        page_size = 200
+        state = {"cursor": None, "done": False, "shown": 0, "pending": False}
         
-        text.config(state=tk.DISABLED)
+        def load_page():
+            state["pending"] = False
+            if state["done"]:
+                return
+            entries, state["cursor"] = self.service.audit_log(
+                start=filters["From"].get().strip() or None,
+                end=filters["To"].get().strip() or None,
+                username=filters["Username"].get().strip() or None,
+                text=filters["Contains"].get().strip() or None,
+                limit=page_size, cursor=state["cursor"])
+            state["done"] = state["cursor"] is None
+            state["shown"] += len(entries)
+            text.config(state=tk.NORMAL)
+            text.insert(tk.END, "".join(f"{entry['timestamp']} - {entry['action']}\n" for entry in entries))
+            text.config(state=tk.DISABLED)
+            status.config(text=f"Showing {state['shown']} newest entries" +
+                               ("" if state["done"] else " (scroll for more)"))
+        
+        def apply_filters():
+            state.update(cursor=None, done=False, shown=0)
+            text.config(state=tk.NORMAL)
+            text.delete("1.0", tk.END)
+            text.config(state=tk.DISABLED)
+            load_page()
+        
+        def on_scroll(first, last):
+            text_scroll.set(first, last)
+            # Fetch the next page once the user nears the bottom
+            if float(last) > 0.95 and not state["done"] and not state["pending"]:
+                state["pending"] = True
+                win.after_idle(load_page)
+        
+        text.config(yscrollcommand=on_scroll)
+        ttk.Button(filter_frame, text="Apply", command=apply_filters).grid(row=0, column=8, padx=5)
+        
+        load_page()
 
     def generate_report(self):
-        report_file = os.path.join(REPORTS_DIR, "sample_report.csv")
-        try:
-            with open(report_file, mode="w", newline="") as file:
-                writer = csv.writer(file)
-                writer.writerow(["Customer ID", "Name", "Contact", "Total Transactions"])
-                for cid, data in self.data.customers.items():
-                    total = sum(txn["amount"] for txn in data.get("history", []))
-                    writer.writerow([cid, data["name"], Utils.decrypt(data["contact"]), total])
-            
-            # Show success message with modern styling
-            success_dialog = tk.Toplevel(self.root)
-            success_dialog.title("Report Generated")
-            success_dialog.configure(bg=self.bg_color)
-            success_dialog.resizable(False, False)
-            
-            ttk.Label(success_dialog, 
-                     text=f"Report successfully saved to:\n{report_file}",
-                     style='TLabel').pack(padx=20, pady=20)
-            
-            ttk.Button(success_dialog, text="OK", command=success_dialog.destroy,
-                      style='TButton').pack(pady=(0, 10))
-            
-            self.logger.add("Admin generated report")
-        except PermissionError:
-            messagebox.showerror("Permission Denied", f"Close '{report_file}' and try again.")
+        # Runs on a worker thread; this dialog polls its events queue
+        job = self.service.report_job().start()
+        
+        progress_dialog = tk.Toplevel(self.root)
+        progress_dialog.title("Generating Report")
+        progress_dialog.configure(bg=self.bg_color)
+        progress_dialog.resizable(False, False)
+        
+        status = ttk.Label(progress_dialog, text="Generating report...", style='TLabel')
+        status.pack(padx=20, pady=(20, 10))
+        
+        progress = ttk.Progressbar(progress_dialog, length=300, mode='determinate',
+                                   maximum=max(len(self.data.customers), 1))
+        progress.pack(padx=20, pady=(0, 10))
+        
+        cancel_btn = ttk.Button(progress_dialog, text="Cancel", command=job.cancel,
+                                style='TButton')
+        cancel_btn.pack(pady=(0, 10))
+        
+        def poll():
+            try:
+                while True:
+                    event, value, total = job.events.get_nowait()
+                    if event == "progress":
+                        progress['value'] = value
+                        status.config(text=f"Generating report... {value}/{total}")
+                    elif event == "done":
+                        progress_dialog.destroy()
+                        self.show_report_saved(value)
+                        self.service.report_done()
+                        self.persist()
+                        return
+                    elif event == "cancelled":
+                        progress_dialog.destroy()
+                        messagebox.showinfo("Report Cancelled", "Report generation was cancelled.")
+                        return
+                    elif event == "error":
+                        progress_dialog.destroy()
+                        if isinstance(value, PermissionError):
+                            messagebox.showerror("Permission Denied", f"Could not write '{job.path}'.")
+                        else:
+                            messagebox.showerror("Error", f"Report failed: {value}")
+                        return
+            except queue.Empty:
+                pass
+            progress_dialog.after(100, poll)
+        
+        progress_dialog.protocol("WM_DELETE_WINDOW", job.cancel)
+        progress_dialog.after(100, poll)
+
+    def generate_batch_reports(self):
+        # The process pool is driven from a worker thread so the UI stays live
+        results = queue.Queue()
+        
+        def work():
+            try:
+                results.put(("done", self.service.generate_batch_reports()))
+            except Exception as e:
+                results.put(("error", e))
+        
+        threading.Thread(target=work, daemon=True).start()
+        
+        progress_dialog = tk.Toplevel(self.root)
+        progress_dialog.title("Batch Reports")
+        progress_dialog.configure(bg=self.bg_color)
+        progress_dialog.resizable(False, False)
+        ttk.Label(progress_dialog, text="Generating compliance reports...",
+                 style='TLabel').pack(padx=20, pady=20)
+        
+        def poll():
+            try:
+                event, value = results.get_nowait()
+            except queue.Empty:
+                progress_dialog.after(100, poll)
+                return
+            progress_dialog.destroy()
+            if event == "error":
+                messagebox.showerror("Error", f"Batch reports failed: {value}")
+                return
+            lines = [f"{name}: {value['timings'][name]:.2f}s\n  {value['paths'][name]}"
+                     for name in BATCH_REPORTS]
+            lines.append(f"Wall time: {value['wall_time']:.2f}s")
+            messagebox.showinfo("Batch Reports Generated", "\n".join(lines))
+            self.persist()
+        
+        progress_dialog.after(100, poll)
+
+    def show_report_saved(self, report_file):
+        # Show success message with modern styling
+        success_dialog = tk.Toplevel(self.root)
+        success_dialog.title("Report Generated")
+        success_dialog.configure(bg=self.bg_color)
+        success_dialog.resizable(False, False)
+        
+        ttk.Label(success_dialog, 
+                 text=f"Report successfully saved to:\n{report_file}",
+                 style='TLabel').pack(padx=20, pady=20)
+        
+        ttk.Button(success_dialog, text="OK", command=success_dialog.destroy,
+                  style='TButton').pack(pady=(0, 10))
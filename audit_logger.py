@@ -1,18 +1,259 @@
 from utils import Utils
-from constants import AUDIT_LOG_FILE
-import datetime
+from constants import AUDIT_LOG_FILE, LEGACY_AUDIT_LOG_FILE
+import datetime, json, os, threading, atexit
 
 class AuditLogger:
-    def __init__(self, audit_file=None):
+    # Entries are stored as JSON Lines: one object per line, appended. Adds go
+    # into a bounded buffer that is written when it reaches buffer_size, every
+    # flush_interval seconds from a background thread, and on close/exit.
+    #
+    # audit_file is the active segment. When it grows past max_segment_bytes or
+    # its first entry is older than max_segment_age seconds it is rotated to
+    # "<audit_file>.000001", "<audit_file>.000002", ... and described in the
+    # "<audit_file>.idx" index (first/last timestamp plus a sparse list of
+    # timestamp -> byte offset), so range reads only open matching segments.
+    SPARSE_EVERY = 256
+
+    def __init__(self, audit_file=None, buffer_size=1, flush_interval=None, legacy_file=None,
+                 max_segment_bytes=1024 * 1024, max_segment_age=24 * 60 * 60):
         self.audit_file = audit_file or AUDIT_LOG_FILE
-        self.log = Utils.load_json(self.audit_file, [])
+        self.index_file = self.audit_file + ".idx"
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_age = max_segment_age
+        self.buffer_size = max(1, buffer_size)
+        self.max_buffer = self.buffer_size * 10
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+
+        if audit_file is None and legacy_file is None:
+            legacy_file = LEGACY_AUDIT_LOG_FILE
+        self._migrate(legacy_file)
+        self.segments = Utils.load_json(self.index_file, {"segments": []})["segments"]
+        self._active_first = self._first_timestamp(self.audit_file)
+
+        self._flusher = None
+        if flush_interval:
+            self._flusher = threading.Thread(target=self._run_flusher, daemon=True)
+            self._flusher.start()
+        atexit.register(self.close)
 
-    def add(self, action):
-        self.log.append({"action": action, "timestamp": str(datetime.datetime.now())})
-        self.save()
+    @property
+    def log(self):
+        return self.get_log()
+
+    def add(self, action, username=None):
+        entry = {"action": action, "timestamp": str(datetime.datetime.now())}
+        if username is not None:
+            entry["username"] = username
+        with self._lock:
+            self._buffer.append(entry)
+            pending = len(self._buffer)
+        if pending >= self.max_buffer or (pending >= self.buffer_size and self._flusher is None):
+            self.flush()
+        elif pending >= self.buffer_size:
+            self._wakeup.set()
 
     def get_log(self):
-        return self.log
+        return self.read_range()
+
+    def read_range(self, start=None, end=None):
+        # Entries with start <= timestamp <= end, oldest first. Bounds may be
+        # datetimes or timestamp strings; None leaves that side open.
+        start = str(start) if start is not None else None
+        end = str(end) if end is not None else None
+        entries = []
+        for segment in self.segments:
+            if (start is not None and segment["last"] < start) or \
+               (end is not None and segment["first"] > end):
+                continue
+            entries.extend(self._read_file(segment["file"], self._seek_offset(segment, start), start, end))
+        entries.extend(self._read_file(self.audit_file, 0, start, end))
+        with self._lock:
+            entries.extend(e for e in self._buffer if self._in_range(e, start, end))
+        return entries
+
+    def query(self, start=None, end=None, username=None, text=None, limit=100, cursor=None):
+        # One page of entries, newest first, matching every given filter.
+        # Returns (entries, cursor); pass the cursor back to get the next
+        # (older) page, None means there is nothing left. Segments outside the
+        # time range are skipped via the index and reading stops as soon as
+        # the page is full.
+        start = str(start) if start is not None else None
+        end = str(end) if end is not None else None
+        upper, skip = cursor if cursor else (None, 0)
+        if upper is not None and (end is None or upper < end):
+            end = upper
+        text = text.lower() if text else None
+
+        matches = []
+        last_ts, seen = None, 0
+        for entries in self._newest_first(start, end):
+            for entry in entries:
+                ts = entry.get("timestamp", "")
+                if ts != last_ts:
+                    last_ts, seen = ts, 0
+                seen += 1
+                if ts == upper and seen <= skip:
+                    continue
+                if self._matches(entry, username, text):
+                    matches.append(entry)
+                    if len(matches) == limit:
+                        return matches, (last_ts, seen)
+        return matches, None
+
+    @staticmethod
+    def _matches(entry, username, text):
+        if username is not None:
+            if "username" in entry:
+                if entry["username"] != username:
+                    return False
+            elif not entry["action"].endswith(f" by {username}"):
+                # Entries written before usernames were recorded
+                return False
+        return text is None or text in entry["action"].lower()
+
+    def _newest_first(self, start, end):
+        # Taken together under the write lock so a concurrent flush can't move
+        # an entry from the buffer into the file between the two reads
+        with self._write_lock:
+            with self._lock:
+                buffered = [e for e in self._buffer if self._in_range(e, start, end)]
+            active = self._read_file(self.audit_file, 0, start, end)
+        yield buffered[::-1]
+        yield active[::-1]
+        for segment in reversed(self.segments):
+            if (start is not None and segment["last"] < start) or \
+               (end is not None and segment["first"] > end):
+                continue
+            yield self._read_file(segment["file"], self._seek_offset(segment, start), start, end)[::-1]
+
+    def _seek_offset(self, segment, start):
+        offset = 0
+        if start is not None:
+            for ts, position in segment["sparse"]:
+                if ts > start:
+                    break
+                offset = position
+        return offset
+
+    def flush(self):
+        with self._write_lock:
+            with self._lock:
+                pending, self._buffer = self._buffer, []
+            if not pending:
+                return 0
+            if self._should_rotate():
+                self.rotate()
+            if self._active_first is None:
+                self._active_first = pending[0]["timestamp"]
+            lines = "".join(json.dumps(entry) + "\n" for entry in pending)
+            with open(self.audit_file, "a") as file:
+                file.write(lines)
+                file.flush()
+                os.fsync(file.fileno())
+            return len(pending)
 
     def save(self):
-        Utils.save_json(self.audit_file, self.log)
\ No newline at end of file
+        self.flush()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+
+    def _run_flusher(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _should_rotate(self):
+        if self._active_first is None or not os.path.exists(self.audit_file):
+            return False
+        if os.path.getsize(self.audit_file) >= self.max_segment_bytes:
+            return True
+        age = datetime.datetime.now() - datetime.datetime.fromisoformat(self._active_first)
+        return age.total_seconds() >= self.max_segment_age
+
+    def rotate(self):
+        if not os.path.exists(self.audit_file) or os.path.getsize(self.audit_file) == 0:
+            return None
+        segment = {"file": "%s.%06d" % (self.audit_file, len(self.segments) + 1),
+                   "first": None, "last": None, "count": 0, "sparse": []}
+        with open(self.audit_file, "rb") as file:
+            offset = 0
+            for line in file:
+                try:
+                    ts = json.loads(line)["timestamp"]
+                except (ValueError, KeyError):
+                    offset += len(line)
+                    continue
+                if segment["count"] % self.SPARSE_EVERY == 0:
+                    segment["sparse"].append([ts, offset])
+                segment["first"] = segment["first"] or ts
+                segment["last"] = ts
+                segment["count"] += 1
+                offset += len(line)
+        segment["size"] = offset
+        self.segments.append(segment)
+        Utils.save_json(self.index_file, {"segments": self.segments})
+        os.replace(self.audit_file, segment["file"])
+        self._active_first = None
+        return segment
+
+    @staticmethod
+    def _in_range(entry, start, end):
+        ts = entry.get("timestamp", "")
+        return (start is None or ts >= start) and (end is None or ts <= end)
+
+    def _read_file(self, filename, offset=0, start=None, end=None):
+        entries = []
+        if not os.path.exists(filename):
+            return entries
+        with open(filename, "rb") as file:
+            file.seek(offset)
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn line from an interrupted append
+                    continue
+                if end is not None and entry.get("timestamp", "") > end:
+                    break
+                if self._in_range(entry, start, end):
+                    entries.append(entry)
+        return entries
+
+    def _first_timestamp(self, filename):
+        if not os.path.exists(filename):
+            return None
+        with open(filename, "r") as file:
+            for line in file:
+                try:
+                    return json.loads(line)["timestamp"]
+                except (ValueError, KeyError):
+                    continue
+        return None
+
+    def _migrate(self, legacy_file):
+        # One-time conversion from the old single JSON array format, either in
+        # place or from the legacy file when the JSONL log doesn't exist yet.
+        source = None
+        if os.path.exists(self.audit_file):
+            with open(self.audit_file, "r") as file:
+                if file.read(64).lstrip().startswith("["):
+                    source = self.audit_file
+        elif legacy_file and os.path.exists(legacy_file):
+            source = legacy_file
+        if source is None:
+            return
+        entries = Utils.load_json(source, [])
+        Utils.atomic_write(self.audit_file, "".join(json.dumps(entry) + "\n" for entry in entries))
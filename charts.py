@@ -0,0 +1,87 @@
+class ChartPanel:
+    # One matplotlib Figure and canvas for a dashboard panel, created once and
+    # reused on every refresh. Figures come from the object-oriented API, so
+    # nothing is registered with pyplot and a dropped panel is simply garbage
+    # collected. matplotlib is only imported when the first panel is built.
+    def __init__(self, master, figsize=(6, 4), facecolor="white", canvas_factory=None):
+        from matplotlib.figure import Figure
+        if canvas_factory is None:
+            from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+            canvas_factory = lambda figure: FigureCanvasTkAgg(figure, master=master)
+        self.figure = Figure(figsize=figsize, facecolor=facecolor)
+        self.ax = self.figure.add_subplot()
+        self.ax.set_facecolor(facecolor)
+        self.canvas = canvas_factory(self.figure)
+        self.artists = None
+        self.draws = 0
+        self._drawn = None
+
+    def widget(self):
+        return self.canvas.get_tk_widget()
+
+    def update(self, key, draw):
+        # draw(panel) is skipped when key matches what is already on screen
+        if key == self._drawn:
+            return False
+        draw(self)
+        self._drawn = key
+        self.canvas.draw_idle()
+        self.draws += 1
+        return True
+
+
+class ChartManager:
+    # Owns the panels of a dashboard by name. update_bars() moves the existing
+    # rectangles rather than replotting, and an unchanged panel is not
+    # redrawn at all.
+    def __init__(self, canvas_factory=None):
+        self.canvas_factory = canvas_factory
+        self.panels = {}
+
+    def panel(self, name, master, **kwargs):
+        panel = self.panels.get(name)
+        if panel is None:
+            panel = ChartPanel(master, canvas_factory=self.canvas_factory, **kwargs)
+            self.panels[name] = panel
+        return panel
+
+    def update_bars(self, name, lefts, widths, counts, log=False, **style):
+        panel = self.panels[name]
+
+        def draw(panel):
+            bars = panel.artists
+            if bars is None or len(bars) != len(counts):
+                if bars is not None:
+                    bars.remove()
+                bars = panel.ax.bar(lefts, counts, width=widths, align='edge', **style)
+                panel.artists = bars
+            else:
+                for rect, left, width, count in zip(bars, lefts, widths, counts):
+                    if rect.get_x() != left or rect.get_width() != width:
+                        rect.set_x(left)
+                        rect.set_width(width)
+                    if rect.get_height() != count:
+                        rect.set_height(count)
+            panel.ax.set_xscale('log' if log else 'linear')
+            panel.ax.relim()
+            panel.ax.autoscale_view()
+
+        return panel.update((tuple(lefts), tuple(widths), tuple(counts), log), draw)
+
+    def update_pie(self, name, sizes, labels, colors, title=None, **style):
+        panel = self.panels[name]
+
+        def draw(panel):
+            # Wedge angles depend on every size, so the pie is replotted on
+            # the same axes whenever any of them changes
+            panel.ax.clear()
+            panel.artists = panel.ax.pie(sizes, labels=labels, colors=colors, **style)
+            if title:
+                panel.ax.set_title(title, color=style.get('textprops', {}).get('color'))
+
+        return panel.update((tuple(sizes), tuple(labels)), draw)
+
+    def close(self):
+        for panel in self.panels.values():
+            panel.figure.clear()
+        self.panels.clear()
@@ -0,0 +1,199 @@
+import datetime, math
+from array import array
+
+np = None
+_numpy_checked = False
+
+def _numpy():
+    # NumPy is imported on first use so it doesn't slow down app startup
+    global np, _numpy_checked
+    if not _numpy_checked:
+        _numpy_checked = True
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            np = None
+    return np
+
+
+def parse_timestamp(ts):
+    try:
+        return datetime.datetime.fromisoformat(ts).timestamp()
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class ColumnarLedger:
+    # Column-oriented copy of the transaction ledger for aggregates, fraud
+    # re-scoring and the batch reports. Amounts and epoch timestamps live in
+    # contiguous float64 arrays; customer ids, staff usernames and dates
+    # (the timestamp's first ten characters) are dictionary-encoded into int32
+    # code arrays. Deleted rows are
+    # masked out rather than removed so every update is O(1); compact() drops
+    # them. When NumPy is installed the aggregates run on zero-copy views of
+    # the arrays, otherwise they fall back to plain loops.
+    NO_STAFF = -1
+    NO_DAY = -1
+
+    def __init__(self, transactions=()):
+        self.amounts = array("d")
+        self.epochs = array("d")
+        self.customer_codes = array("i")
+        self.staff_codes = array("i")
+        self.day_codes = array("i")
+        self.live = array("b")
+        self.ids = []
+        self.customer_ids = []
+        self.staff_names = []
+        self.days = []
+        self._customer_lookup = {}
+        self._staff_lookup = {}
+        self._day_lookup = {}
+        self._rows = {}
+        for txn in transactions:
+            self.on_add(txn)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def append(self, txn_id, customer_id, amount, timestamp=None, staff=None):
+        # One row from its field values, so a store that can read the columns
+        # directly never has to build a record per row
+        self._rows[txn_id] = len(self.ids)
+        self.ids.append(txn_id)
+        self.amounts.append(float(amount))
+        self.epochs.append(parse_timestamp(timestamp))
+        self.customer_codes.append(self._encode(customer_id, self.customer_ids, self._customer_lookup))
+        self.staff_codes.append(self.NO_STAFF if staff is None
+                                else self._encode(staff, self.staff_names, self._staff_lookup))
+        self.day_codes.append(self.NO_DAY if not timestamp
+                              else self._encode(timestamp[:10], self.days, self._day_lookup))
+        self.live.append(1)
+
+    # DataManager listener interface
+    def on_add(self, txn):
+        self.append(txn["id"], txn["customer_id"], txn["amount"], txn.get("timestamp"),
+                    txn.get("staff_username"))
+
+    def on_update(self, txn, old_amount):
+        row = self._rows.get(txn["id"])
+        if row is not None:
+            self.amounts[row] = float(txn["amount"])
+
+    def on_delete(self, txn):
+        row = self._rows.pop(txn["id"], None)
+        if row is not None:
+            self.live[row] = 0
+
+    @staticmethod
+    def _encode(value, values, lookup):
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(values)
+            values.append(value)
+        return code
+
+    def compact(self):
+        rows = sorted(self._rows.values())
+        self.amounts = array("d", (self.amounts[i] for i in rows))
+        self.epochs = array("d", (self.epochs[i] for i in rows))
+        self.customer_codes = array("i", (self.customer_codes[i] for i in rows))
+        self.staff_codes = array("i", (self.staff_codes[i] for i in rows))
+        self.day_codes = array("i", (self.day_codes[i] for i in rows))
+        self.live = array("b", [1] * len(rows))
+        self.ids = [self.ids[i] for i in rows]
+        self._rows = {txn_id: i for i, txn_id in enumerate(self.ids)}
+
+    def copy(self):
+        # Snapshot for readers outside the owner's lock, e.g. the batch
+        # reports; the arrays are copied with a single memcpy each
+        ledger = ColumnarLedger()
+        for name in ("amounts", "epochs", "customer_codes", "staff_codes", "day_codes", "live"):
+            setattr(ledger, name, array(getattr(self, name).typecode, getattr(self, name)))
+        for name in ("ids", "customer_ids", "staff_names", "days"):
+            setattr(ledger, name, list(getattr(self, name)))
+        for name in ("_customer_lookup", "_staff_lookup", "_day_lookup", "_rows"):
+            setattr(ledger, name, dict(getattr(self, name)))
+        return ledger
+
+    def index(self, txn_id):
+        # Row of a live transaction, or None
+        return self._rows.get(txn_id)
+
+    def row(self, txn_id):
+        # Dict view of a single row, shaped like a ledger record
+        i = self._rows[txn_id]
+        staff = self.staff_codes[i]
+        return {
+            "id": txn_id,
+            "customer_id": self.customer_ids[self.customer_codes[i]],
+            "amount": self.amounts[i],
+            "epoch": self.epochs[i],
+            "staff_username": None if staff == self.NO_STAFF else self.staff_names[staff],
+        }
+
+    # Aggregates
+    def _columns(self):
+        if _numpy() is None:
+            return None
+        live = np.frombuffer(self.live, dtype=np.int8).astype(bool)
+        return np.frombuffer(self.amounts, dtype=np.float64), live
+
+    def amount_values(self):
+        cols = self._columns()
+        if cols is not None:
+            amounts, live = cols
+            return amounts[live]
+        return [a for a, ok in zip(self.amounts, self.live) if ok]
+
+    def total(self):
+        cols = self._columns()
+        if cols is not None:
+            amounts, live = cols
+            return float(amounts[live].sum())
+        return math.fsum(self.amount_values())
+
+    def count_above(self, threshold):
+        cols = self._columns()
+        if cols is not None:
+            amounts, live = cols
+            return int(np.count_nonzero(live & (amounts > threshold)))
+        return sum(1 for a in self.amount_values() if a > threshold)
+
+    def histogram(self, bins=10):
+        values = self.amount_values()
+        if _numpy() is not None:
+            counts, edges = np.histogram(values, bins=bins)
+            return counts.tolist(), edges.tolist()
+        if not values:
+            return [0] * bins, [0.0] * (bins + 1)
+        low, high = min(values), max(values)
+        width = (high - low) / bins or 1.0
+        counts = [0] * bins
+        for a in values:
+            counts[min(int((a - low) / width), bins - 1)] += 1
+        return counts, [low + width * i for i in range(bins + 1)]
+
+    def _totals_by(self, codes, names):
+        cols = self._columns()
+        if cols is not None:
+            amounts, live = cols
+            codes = np.frombuffer(codes, dtype=np.int32)
+            keep = live & (codes >= 0)
+            sums = np.bincount(codes[keep], weights=amounts[keep], minlength=len(names))
+            return {name: float(sums[i]) for i, name in enumerate(names)}
+        sums = [0.0] * len(names)
+        for a, code, ok in zip(self.amounts, codes, self.live):
+            if ok and code >= 0:
+                sums[code] += a
+        return dict(zip(names, sums))
+
+    def totals_by_customer(self):
+        return self._totals_by(self.customer_codes, self.customer_ids)
+
+    def totals_by_staff(self):
+        return self._totals_by(self.staff_codes, self.staff_names)
+
+    def totals_by_day(self):
+        return self._totals_by(self.day_codes, self.days)
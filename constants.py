@@ -1,6 +1,11 @@
 CUSTOMERS_FILE = "customers.json"
 TRANSACTIONS_FILE = "transactions.json"
-AUDIT_LOG_FILE = "audit_log.json"
+AUDIT_LOG_FILE = "audit_log.jsonl"
+LEGACY_AUDIT_LOG_FILE = "audit_log.json"
 CREDENTIALS_FILE = "credentials.json"
 DASHBOARD_FILE = "dashboard_data.json"
 REPORTS_DIR = "reports"
+JOURNAL_FILE = "journal.jsonl"
+DATABASE_FILE = "finsecure.db"
+SNAPSHOT_FILE = "finsecure.snap"
+SUSPICIOUS_THRESHOLD = 10000
\ No newline at end of file
@@ -0,0 +1,332 @@
+import math
+from collections import deque
+import columnar
+from columnar import parse_timestamp
+from constants import SUSPICIOUS_THRESHOLD
+
+# Rules score one transaction at a time against per-customer state that they
+# create with new_state(): check() decides whether the transaction trips the
+# rule and update() then folds it into the state. Both are O(1) and the state
+# is bounded (fixed-length deques, running averages), so a customer's state
+# never grows with their history. Amounts are floats and times are epoch
+# seconds; a transaction without a parseable timestamp is skipped by the
+# windowed rules. vectorized() scores a whole ledger sorted by customer and
+# time with NumPy, or returns None to have FraudEngine.backfill() replay it.
+
+class Rule:
+    name = None
+    stateful = True
+
+    def new_state(self):
+        return None
+
+    def check(self, state, amount, epoch):
+        raise NotImplementedError
+
+    def update(self, state, amount, epoch):
+        pass
+
+    def vectorized(self, np, groups, amounts, epochs):
+        return None
+
+
+def _kth_previous_within(np, groups, epochs, k, window):
+    # True where the k-th previous row belongs to the same customer and lies
+    # within `window` seconds
+    hits = np.zeros(len(groups), dtype=bool)
+    if k < len(groups):
+        hits[k:] = (groups[k:] == groups[:-k]) & (epochs[k:] - epochs[:-k] <= window)
+    return hits
+
+
+class ThresholdRule(Rule):
+    # A single transaction above the threshold
+    name = "threshold"
+    stateful = False
+
+    def __init__(self, threshold=SUSPICIOUS_THRESHOLD):
+        self.threshold = threshold
+
+    def check(self, state, amount, epoch):
+        return amount > self.threshold
+
+    def vectorized(self, np, groups, amounts, epochs):
+        return amounts > self.threshold
+
+
+class VelocityRule(Rule):
+    # More than max_count transactions within `window` seconds. The state is
+    # the times of the customer's last max_count transactions.
+    name = "velocity"
+
+    def __init__(self, max_count=5, window=3600):
+        self.max_count = max_count
+        self.window = window
+
+    def new_state(self):
+        return deque(maxlen=self.max_count)
+
+    def check(self, state, amount, epoch):
+        return len(state) == self.max_count and epoch - state[0] <= self.window
+
+    def update(self, state, amount, epoch):
+        if not math.isnan(epoch):
+            state.append(epoch)
+
+    def vectorized(self, np, groups, amounts, epochs):
+        if np.isnan(epochs).any():
+            return None
+        return _kth_previous_within(np, groups, epochs, self.max_count, self.window)
+
+
+class _Window:
+    __slots__ = ("items", "total")
+
+    def __init__(self):
+        self.items = deque()
+        self.total = 0.0
+
+
+class RollingSumRule(Rule):
+    # More than `limit` moved (in absolute value) within `window` seconds,
+    # counting the customer's last max_items transactions at most
+    name = "rolling_sum"
+
+    def __init__(self, limit=5 * SUSPICIOUS_THRESHOLD, window=86400, max_items=100):
+        self.limit = limit
+        self.window = window
+        self.max_items = max_items
+
+    def new_state(self):
+        return _Window()
+
+    def check(self, state, amount, epoch):
+        if math.isnan(epoch):
+            return False
+        items = state.items
+        while items and epoch - items[0][0] > self.window:
+            state.total -= items.popleft()[1]
+        if not items:
+            state.total = 0.0  # don't let rounding error accumulate
+        return state.total + abs(amount) > self.limit
+
+    def update(self, state, amount, epoch):
+        if math.isnan(epoch):
+            return
+        state.items.append((epoch, abs(amount)))
+        state.total += abs(amount)
+        if len(state.items) > self.max_items:
+            state.total -= state.items.popleft()[1]
+
+    def vectorized(self, np, groups, amounts, epochs):
+        if np.isnan(epochs).any():
+            return None
+        if not len(amounts):
+            return np.zeros(0, dtype=bool)
+        # One sorted key over (customer, time) so a single searchsorted finds
+        # where every row's window starts
+        offsets = epochs - epochs.min()
+        keys = groups * (offsets.max() + self.window + 1) + offsets
+        rows = np.arange(len(amounts))
+        starts = np.maximum(np.searchsorted(keys, keys - self.window, "left"), rows - self.max_items)
+        sums = np.concatenate(([0.0], np.cumsum(np.abs(amounts))))
+        return sums[rows + 1] - sums[starts] > self.limit
+
+
+class DeviationRule(Rule):
+    # An amount more than `factor` deviations from the customer's typical
+    # amount, tracked as an exponentially weighted mean and variance. The
+    # deviation is floored at `floor` times the mean so a customer with
+    # identical amounts isn't flagged for a small change. Needs min_history
+    # earlier transactions.
+    name = "deviation"
+
+    def __init__(self, factor=5.0, alpha=0.1, min_history=5, floor=0.1):
+        self.factor = factor
+        self.alpha = alpha
+        self.min_history = min_history
+        self.floor = floor
+
+    def new_state(self):
+        return [0, 0.0, 0.0]  # count, mean, variance
+
+    def check(self, state, amount, epoch):
+        count, mean, variance = state
+        if count < self.min_history:
+            return False
+        return abs(amount - mean) > self.factor * max(math.sqrt(variance), self.floor * abs(mean))
+
+    def update(self, state, amount, epoch):
+        if not state[0]:
+            state[1] = amount
+        else:
+            diff = amount - state[1]
+            step = self.alpha * diff
+            state[1] += step
+            state[2] = (1 - self.alpha) * (state[2] + diff * step)
+        state[0] += 1
+
+    # The running mean is a recurrence, so backfill replays this rule
+
+
+class StructuringRule(Rule):
+    # Amounts kept just under the threshold: `count` transactions within
+    # `margin` below it inside `window` seconds. The state is the times of the
+    # customer's last count - 1 such transactions.
+    name = "structuring"
+
+    def __init__(self, threshold=SUSPICIOUS_THRESHOLD, margin=0.1, count=3, window=7 * 86400):
+        self.low = threshold * (1 - margin)
+        self.threshold = threshold
+        self.count = count
+        self.window = window
+
+    def near(self, amount):
+        return self.low <= amount <= self.threshold
+
+    def new_state(self):
+        return deque(maxlen=self.count - 1)
+
+    def check(self, state, amount, epoch):
+        return self.near(amount) and len(state) == self.count - 1 and \
+            epoch - state[0] <= self.window
+
+    def update(self, state, amount, epoch):
+        if self.near(amount) and not math.isnan(epoch):
+            state.append(epoch)
+
+    def vectorized(self, np, groups, amounts, epochs):
+        if np.isnan(epochs).any():
+            return None
+        near = (amounts >= self.low) & (amounts <= self.threshold)
+        rows = np.flatnonzero(near)
+        hits = np.zeros(len(amounts), dtype=bool)
+        hits[rows] = _kth_previous_within(np, groups[rows], epochs[rows], self.count - 1, self.window)
+        return hits
+
+
+def default_rules():
+    return [ThresholdRule(), VelocityRule(), RollingSumRule(), DeviationRule(), StructuringRule()]
+
+
+class FraudEngine:
+    # Scores transactions as they arrive through DataManager's listener hooks
+    # and keeps the names of the rules each flagged transaction tripped.
+    # Per-customer rule state is created when a customer is first seen, warmed
+    # by replaying their earlier transactions from `history` (a
+    # customer_history-style callable) when one is given. Window state follows
+    # arrival order and is not rewound by edits or deletes: on_update only
+    # re-scores the stateless rules, and backfill() re-scores everything.
+    def __init__(self, rules=None, history=None):
+        self.rules = default_rules() if rules is None else list(rules)
+        self.history = history
+        self.reset()
+
+    def reset(self):
+        self._states = {}  # customer id -> one state per rule
+        self.flags = {}    # transaction id -> names of the rules it tripped
+
+    def __len__(self):
+        return len(self.flags)
+
+    def reasons(self, txn_id):
+        return self.flags.get(txn_id, [])
+
+    def counts(self):
+        counts = dict.fromkeys((rule.name for rule in self.rules), 0)
+        for names in self.flags.values():
+            for name in names:
+                counts[name] += 1
+        return counts
+
+    def _customer_states(self, txn):
+        cid = txn["customer_id"]
+        states = self._states.get(cid)
+        if states is None:
+            states = self._states[cid] = [rule.new_state() for rule in self.rules]
+            for past in (self.history(cid) if self.history else ()):
+                if past.get("id") != txn.get("id"):
+                    self._update(states, past)
+        return states
+
+    def _update(self, states, txn):
+        amount, epoch = float(txn["amount"]), parse_timestamp(txn.get("timestamp"))
+        for rule, state in zip(self.rules, states):
+            rule.update(state, amount, epoch)
+
+    def score(self, txn):
+        # Scores txn and folds it into its customer's state; returns the names
+        # of the rules it trips
+        states = self._customer_states(txn)
+        amount, epoch = float(txn["amount"]), parse_timestamp(txn.get("timestamp"))
+        names = [rule.name for rule, state in zip(self.rules, states)
+                 if rule.check(state, amount, epoch)]
+        for rule, state in zip(self.rules, states):
+            rule.update(state, amount, epoch)
+        return names
+
+    # DataManager listener interface
+    def on_add(self, txn):
+        names = self.score(txn)
+        if names:
+            self.flags[txn["id"]] = names
+
+    def on_update(self, txn, old_amount):
+        previous = set(self.reasons(txn["id"]))
+        amount = float(txn["amount"])
+        names = [rule.name for rule in self.rules
+                 if (rule.name in previous if rule.stateful else rule.check(None, amount, math.nan))]
+        if names:
+            self.flags[txn["id"]] = names
+        else:
+            self.flags.pop(txn["id"], None)
+
+    def on_delete(self, txn):
+        self.flags.pop(txn["id"], None)
+
+    def backfill(self, ledger):
+        # Re-scores a ColumnarLedger in one pass over its live rows sorted by
+        # customer and time. With NumPy each rule that supports it scores all
+        # rows at once on views of the ledger's arrays; the others, and every
+        # rule without NumPy, replay the sorted rows. Customer state is
+        # rebuilt lazily afterwards.
+        self.reset()
+        np = columnar._numpy()
+        if np is not None:
+            groups = np.frombuffer(ledger.customer_codes, dtype=np.int32)
+            amounts = np.frombuffer(ledger.amounts, dtype=np.float64)
+            epochs = np.frombuffer(ledger.epochs, dtype=np.float64)
+            rows = np.flatnonzero(np.frombuffer(ledger.live, dtype=np.int8))
+            order = rows[np.lexsort((epochs[rows], groups[rows]))]  # NaN times sort last
+            groups, amounts, epochs = groups[order], amounts[order], epochs[order]
+        else:
+            groups, amounts, epochs = ledger.customer_codes, ledger.amounts, ledger.epochs
+            order = sorted((i for i, live in enumerate(ledger.live) if live),
+                           key=lambda i: (groups[i], math.isnan(epochs[i]), epochs[i]))
+            groups, amounts, epochs = ([column[i] for i in order] for column in (groups, amounts, epochs))
+
+        hits = []
+        for rule in self.rules:
+            rule_hits = rule.vectorized(np, groups, amounts, epochs) if np is not None else None
+            hits.append(self._replay(rule, groups, amounts, epochs) if rule_hits is None else rule_hits)
+        if np is not None and hits:
+            hits = np.vstack(hits)
+            rows = np.flatnonzero(hits.any(axis=0))
+            hits = hits[:, rows].T
+        else:
+            hits = list(zip(*hits))
+            rows = [row for row, flagged in enumerate(hits) if any(flagged)]
+            hits = [hits[row] for row in rows]
+        for row, flagged in zip(rows, hits):
+            self.flags[ledger.ids[order[row]]] = [rule.name for rule, hit in zip(self.rules, flagged) if hit]
+        return len(self.flags)
+
+    @staticmethod
+    def _replay(rule, groups, amounts, epochs):
+        hits, state, current = [], None, None
+        for group, amount, epoch in zip(groups, amounts, epochs):
+            if group != current:
+                state, current = rule.new_state(), group
+            hits.append(bool(rule.check(state, amount, epoch)))
+            rule.update(state, amount, epoch)
+        return hits
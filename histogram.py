@@ -0,0 +1,80 @@
+import bisect, math
+
+class AmountHistogram:
+    # Bucket counts over fixed bin edges, updated incrementally by DataManager's
+    # listener hooks so the dashboard chart draws a few bars instead of every
+    # amount. Edges are linear or log-scaled; amounts outside them are counted
+    # as underflow/overflow until the DataManager rebuilds it from the full
+    # data with a new layout.
+    def __init__(self, edges, scale="linear"):
+        self.edges = list(edges)
+        self.scale = scale
+        self.counts = [0] * (len(self.edges) - 1)
+        self.underflow = 0
+        self.overflow = 0
+
+    @classmethod
+    def from_amounts(cls, amounts, bins=10, scale="linear"):
+        histogram = cls(cls.make_edges(amounts, bins, scale), scale)
+        for amount in amounts:
+            histogram.add(amount)
+        return histogram
+
+    @staticmethod
+    def make_edges(amounts, bins=10, scale="linear"):
+        low = min(amounts, default=0.0)
+        high = max(amounts, default=1.0)
+        if scale == "log":
+            # Log bins cover the positive amounts; anything <= 0 is underflow
+            positive = [a for a in amounts if a > 0]
+            low = math.log10(min(positive, default=1.0))
+            high = math.log10(max(positive, default=10.0))
+            if high <= low:
+                high = low + 1
+            return [10 ** (low + (high - low) * i / bins) for i in range(bins + 1)]
+        if high <= low:
+            high = low + 1
+        return [low + (high - low) * i / bins for i in range(bins + 1)]
+
+    def _bucket(self, amount):
+        if amount < self.edges[0]:
+            return -1
+        if amount > self.edges[-1]:
+            return len(self.counts)
+        # The last bin includes its right edge, like numpy.histogram
+        return min(bisect.bisect_right(self.edges, amount) - 1, len(self.counts) - 1)
+
+    def add(self, amount, sign=1):
+        bucket = self._bucket(amount)
+        if bucket < 0:
+            self.underflow += sign
+        elif bucket >= len(self.counts):
+            self.overflow += sign
+        else:
+            self.counts[bucket] += sign
+
+    def remove(self, amount):
+        self.add(amount, -1)
+
+    def total(self):
+        return sum(self.counts) + self.underflow + self.overflow
+
+    def needs_rebin(self):
+        return self.underflow + self.overflow > 0
+
+    def bars(self):
+        # (left edges, widths, counts), ready for Axes.bar(align="edge")
+        lefts = self.edges[:-1]
+        widths = [right - left for left, right in zip(self.edges, self.edges[1:])]
+        return lefts, widths, list(self.counts)
+
+    # DataManager listener interface
+    def on_add(self, txn):
+        self.add(txn["amount"])
+
+    def on_update(self, txn, old_amount):
+        self.remove(old_amount)
+        self.add(txn["amount"])
+
+    def on_delete(self, txn):
+        self.remove(txn["amount"])
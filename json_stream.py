@@ -0,0 +1,116 @@
+import codecs, json, mmap, os
+
+class JSONStreamError(ValueError):
+    # offset is the byte offset where the bad record starts, error_offset
+    # where parsing actually failed
+    def __init__(self, filename, message, offset, error_offset=None):
+        self.filename = filename
+        self.offset = offset
+        self.error_offset = offset if error_offset is None else error_offset
+        super().__init__(f"{filename}: {message} in record at byte {offset} "
+                         f"(error at byte {self.error_offset})")
+
+
+class _Reader:
+    # Decodes the memory-mapped file a chunk at a time into a text buffer that
+    # holds the record being parsed plus at most one chunk of lookahead.
+    _decoder = json.JSONDecoder()
+
+    def __init__(self, filename, data, chunk_size, max_record):
+        self.filename = filename
+        self.data = data
+        self.chunk_size = chunk_size
+        self.max_record = max_record
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.read = 0       # bytes of `data` decoded so far
+        self.base = 0       # byte offset of buf[0]
+        self.buf = ""
+        self.i = 0
+
+    def more(self, size=None):
+        if self.read >= len(self.data):
+            return False
+        chunk = self.data[self.read:self.read + (size or self.chunk_size)]
+        self.read += len(chunk)
+        self.buf += self.utf8.decode(chunk, self.read >= len(self.data))
+        return True
+
+    def offset(self, i=None):
+        return self.base + len(self.buf[:self.i if i is None else i].encode("utf-8"))
+
+    def error(self, message, start=None, at=None):
+        start = self.i if start is None else start
+        return JSONStreamError(self.filename, message, self.offset(start),
+                               self.offset(start if at is None else at))
+
+    def peek(self):
+        while True:
+            while self.i < len(self.buf) and self.buf[self.i] in " \t\r\n":
+                self.i += 1
+            if self.i < len(self.buf) or not self.more():
+                return self.buf[self.i:self.i + 1]
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise self.error(f"expected {' or '.join(repr(c) for c in chars)}, found "
+                             f"{repr(char) if char else 'end of file'}")
+        self.i += 1
+        return char
+
+    def value(self):
+        self.peek()
+        if self.i > self.chunk_size:
+            # Drop consumed text once it outgrows a chunk, not per record
+            self.base = self.offset()
+            self.buf = self.buf[self.i:]
+            self.i = 0
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buf, self.i)
+            except json.JSONDecodeError as e:
+                if self.read >= len(self.data):
+                    raise self.error(f"corrupt record ({e.msg})", at=e.pos) from None
+                if len(self.buf) - self.i > self.max_record:
+                    raise self.error(f"record larger than {self.max_record} characters") from None
+                # Most likely the record continues past the buffer
+                self.more(size)
+                size *= 2
+                continue
+            if end == len(self.buf) and self.more():
+                # A number at the end of the buffer may continue in the next chunk
+                continue
+            self.i = end
+            return value
+
+
+def iter_json(filename, chunk_size=1 << 16, max_record=1 << 24):
+    """Yields the items of a JSON file one at a time: the elements of a
+    top-level array, or (key, value) pairs of a top-level object. A missing
+    or empty file yields nothing. Raises JSONStreamError with the byte offset
+    of the first corrupt record; the records before it have been yielded."""
+    if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+        return
+    with open(filename, "rb") as file, \
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        reader = _Reader(filename, data, chunk_size, max_record)
+        opener = reader.expect("[{")
+        closer = "]" if opener == "[" else "}"
+        if reader.peek() == closer:
+            reader.i += 1
+        else:
+            while True:
+                if opener == "{":
+                    start = reader.i
+                    key = reader.value()
+                    if not isinstance(key, str):
+                        raise reader.error("object key is not a string", start)
+                    reader.expect(":")
+                    yield key, reader.value()
+                else:
+                    yield reader.value()
+                if reader.expect("," + closer) == closer:
+                    break
+        if reader.peek():
+            raise reader.error("unexpected data after the top-level value")
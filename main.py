@@ -1,14 +1,32 @@
-import datetime
+import os
+import sys
+import time
+STARTED = time.perf_counter()
+
 import tkinter as tk
 from tkinter import ttk, messagebox
-from data_manager import DataManager
+from data_manager import open_data_manager
 from audit_logger import AuditLogger
-from app import FinSecureApp
-from utils import Utils
+from persistence import PersistenceExecutor
+from service import FinSecureService, ServiceError
+
+# Startup measurement mode: `python main.py --startup-time` (or
+# FINSECURE_STARTUP_TIME=1) prints the time to each startup milestone and
+# closes the login window once the data stores have finished loading.
+MEASURE_STARTUP = "--startup-time" in sys.argv or os.environ.get("FINSECURE_STARTUP_TIME") == "1"
+
+def report_startup(stage):
+    if MEASURE_STARTUP:
+        print(f"[startup] {stage}: {(time.perf_counter() - STARTED) * 1000:.1f} ms", file=sys.stderr)
 
 def login_window():
-    data_manager = DataManager()
-    logger = AuditLogger()
+    # Only credentials are read here; customers and transactions load in the
+    # background once the login window is up
+    data_manager = open_data_manager(lazy=True)
+    report_startup("credentials loaded")
+    logger = AuditLogger(buffer_size=50, flush_interval=1.0)
+    persistence = PersistenceExecutor()
+    service = FinSecureService(data_manager, logger)
 
     def apply_styles():
         style = ttk.Style()
@@ -34,16 +52,25 @@ def login_window():
         username = user_entry.get()
         password = pass_entry.get()
 
-        if username in data_manager.credentials:
-            stored_password = Utils.decrypt(data_manager.credentials[username])
-            if stored_password == password:
-                role = "admin" if username == "admin" else "staff"
-                login_win.destroy()
-                root = tk.Tk()
-                FinSecureApp(root, role, data_manager, logger, username)  # Pass username here
-                root.mainloop()
-            else:
-                messagebox.showerror("Login Failed", "Invalid credentials")
+        role = service.authenticate(username, password)
+        if role is None:
+            messagebox.showerror("Login Failed", "Invalid credentials")
+            return
+        from app import FinSecureApp
+        try:
+            data_manager.ensure_loaded()
+        except ValueError as e:
+            messagebox.showerror("Data Error", f"Could not load the data files: {e}")
+            return
+        login_win.destroy()
+        root = tk.Tk()
+        FinSecureApp(root, role, data_manager, logger, username, persistence, service)
+        root.mainloop()
+        # Let queued writes finish before the process exits
+        persistence.shutdown()
+        service.logout()
+        data_manager.close()
+        logger.close()
 
     def signup():
         # Create signup dialog with matching styling
@@ -97,31 +124,14 @@ def login_window():
             contact = entries["Contact Info"].get()
             role = entries["Role"].get() if hasattr(entries["Role"], 'get') else "staff"
             
-            # Validate inputs
-            if not all([username, password, name]):
-                messagebox.showerror("Error", "Username, Password and Full Name are required")
-                return
-                
-            if username in data_manager.credentials:
-                messagebox.showerror("Error", "Username already exists")
+            try:
+                service.sign_up(username, password, name, contact, role)
+            except ServiceError as e:
+                messagebox.showerror("Error", str(e))
                 return
-                
-            # Save credentials
-            data_manager.credentials[username] = Utils.encrypt(password)
-            
-            # Create customer record for staff
-            if role == "staff":
-                new_customer_id = str(len(data_manager.customers) + 1)
-                data_manager.customers[new_customer_id] = {
-                    "name": name,
-                    "contact": Utils.encrypt(contact) if contact else Utils.encrypt(""),
-                    "created_at": str(datetime.datetime.now()),
-                    "history": [],
-                    "is_staff": True,
-                    "username": username
-                }
             
-            data_manager.save_all()
+            persistence.submit(service.commit,
+                               on_error=lambda e: messagebox.showerror("Error", f"Account could not be saved: {e}"))
             messagebox.showinfo("Success", "Account created successfully!")
             signup_dialog.destroy()
         
@@ -146,6 +156,7 @@ def login_window():
     
     bg_color, fg_color = apply_styles()
     login_win.configure(bg=bg_color)
+    persistence.attach(login_win)
     
     # Header
     ttk.Label(login_win, text="FinSecure Login", style='Header.TLabel').pack(pady=15)
@@ -175,7 +186,25 @@ def login_window():
     ttk.Button(button_frame, text="Login", command=login).pack(side=tk.LEFT, padx=10)
     ttk.Button(button_frame, text="Sign Up", command=signup).pack(side=tk.LEFT, padx=10)
 
+    def on_shown(event):
+        if event.widget is login_win and not state["shown"]:
+            state["shown"] = True
+            report_startup("login window shown")
+            data_manager.load_async()
+            login_win.after(20, wait_for_stores)
+    
+    def wait_for_stores():
+        if not data_manager.is_loaded():
+            login_win.after(20, wait_for_stores)
+            return
+        report_startup("data stores loaded")
+        if MEASURE_STARTUP:
+            login_win.destroy()
+    
+    state = {"shown": False}
+    login_win.bind("<Map>", on_shown)
     login_win.mainloop()
+    persistence.shutdown()
 
 if __name__ == "__main__":
     login_window()
\ No newline at end of file
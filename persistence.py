@@ -0,0 +1,93 @@
+import queue, threading
+
+class PersistenceExecutor:
+    # A single worker thread that runs persistence tasks in submission order,
+    # so dialogs can update in-memory state and return to the Tk event loop
+    # straight away. Completion and error callbacks are queued back and run
+    # on the Tk thread by a root.after poll loop started with attach().
+    def __init__(self, poll_interval=50):
+        self.poll_interval = poll_interval
+        self._tasks = queue.Queue()
+        self._completions = queue.Queue()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._root = None
+        self._indicators = []
+        self.error_handler = None
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def attach(self, root):
+        # Can be called again when the app switches to a new Tk root
+        self._root = root
+        self._indicators = []
+        root.after(self.poll_interval, self._poll, root)
+
+    def add_indicator(self, callback):
+        # callback(pending) is called on the Tk thread on every poll with the
+        # number of queued or running tasks
+        self._indicators.append(callback)
+
+    def pending(self):
+        with self._lock:
+            return self._pending
+
+    def submit(self, fn, on_done=None, on_error=None):
+        with self._lock:
+            self._pending += 1
+        self._tasks.put((fn, on_done, on_error))
+
+    def wait(self, timeout=None):
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def shutdown(self, timeout=None):
+        self.wait(timeout)
+        if self._worker.is_alive():
+            self._tasks.put(None)
+            self._worker.join(timeout)
+        self._dispatch()
+
+    def _run(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            fn, on_done, on_error = task
+            try:
+                result = fn()
+            except Exception as e:
+                self._completions.put((on_error or self.error_handler, e))
+            else:
+                self._completions.put((on_done, result))
+            with self._idle:
+                self._pending -= 1
+                self._idle.notify_all()
+
+    def _dispatch(self):
+        ran = False
+        while True:
+            try:
+                callback, value = self._completions.get_nowait()
+            except queue.Empty:
+                break
+            ran = True
+            if callback is not None:
+                callback(value)
+        return ran
+
+    def _poll(self, root):
+        if root is not self._root:
+            return
+        try:
+            self._dispatch()
+            pending = self.pending()
+            for indicator in self._indicators:
+                indicator(pending)
+        finally:
+            try:
+                root.after(self.poll_interval, self._poll, root)
+            except Exception:
+                # Root was destroyed
+                pass
@@ -0,0 +1,228 @@
+import concurrent.futures, csv, datetime, multiprocessing, os, queue, threading, time
+from array import array
+from utils import Utils
+from constants import REPORTS_DIR
+
+def report_path(out_dir, prefix="report"):
+    # Timestamped name so concurrent reports never write to the same file
+    stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    return os.path.join(out_dir, f"{prefix}_{stamp}.csv")
+
+
+class ReportJob:
+    # Streams the per-customer report from a worker thread. Rows are produced
+    # by a generator pipeline and written as they arrive; progress, completion
+    # and errors are posted to `events` for the UI thread to poll, since Tk
+    # must only be touched from its own thread.
+    HEADER = ["Customer ID", "Name", "Contact", "Total Transactions"]
+    PROGRESS_EVERY = 500
+
+    def __init__(self, data_manager, out_dir=REPORTS_DIR, secrets=None):
+        self.data = data_manager
+        self.out_dir = out_dir
+        # A DecryptCache shared with the views, so unchanged contacts aren't
+        # decrypted again on every run
+        self.secrets = secrets
+        self.path = None
+        self.events = queue.Queue()
+        self._cancelled = threading.Event()
+        self._thread = None
+
+    def customers(self):
+        # Snapshot the keys so edits on the UI thread can't break iteration
+        for cid in list(self.data.customers):
+            customer = self.data.customers.get(cid)
+            if customer is not None:
+                yield cid, customer
+
+    def rows(self):
+        totals = self.data.aggregates.per_customer
+        for cid, customer in self.customers():
+            if self.secrets is not None:
+                contact = self.secrets.get(("contact", cid), customer["contact"])
+            else:
+                contact = Utils.decrypt(customer["contact"])
+            yield [cid, customer["name"], contact, totals.get(cid, 0)]
+
+    def run(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.path = report_path(self.out_dir)
+        total = len(self.data.customers)
+        written = 0
+        created = False
+        try:
+            with open(self.path, mode="x", newline="") as file:
+                created = True
+                writer = csv.writer(file)
+                writer.writerow(self.HEADER)
+                for row in self.rows():
+                    if self._cancelled.is_set():
+                        break
+                    writer.writerow(row)
+                    written += 1
+                    if written % self.PROGRESS_EVERY == 0:
+                        self.events.put(("progress", written, total))
+            if self._cancelled.is_set():
+                os.unlink(self.path)
+                self.events.put(("cancelled", written, total))
+                return None
+        except Exception as e:
+            # A truncated file could be mistaken for a finished report
+            if created and os.path.exists(self.path):
+                os.unlink(self.path)
+            self.events.put(("error", e, total))
+            return None
+        self.events.put(("done", self.path, written))
+        return self.path
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+# Batch reports. They read a snapshot of the DataManager's ColumnarLedger,
+# whose code and amount arrays are handed to each worker of a process pool
+# through the pool initializer: with the fork start method the workers
+# inherit them without pickling, otherwise they are sent once per worker.
+# They are never stored in this process's globals, so concurrent runs can't
+# see each other's data. Tasks only carry (report, start, end) and partials
+# are keyed by code; names are decoded when the reports are written.
+BATCH_REPORTS = ("customer_totals", "staff_activity", "daily_volumes", "suspicious")
+_SHARED = None
+
+def _init_worker(shared):
+    global _SHARED
+    _SHARED = shared
+
+def _compute_partial(report, start, end):
+    started = time.perf_counter()
+    codes_by_report, amounts, live, flagged = _SHARED
+    if report == "suspicious":
+        partial = [i for i in range(start, end) if live[i] and flagged[i]]
+    else:
+        codes = codes_by_report[report]
+        partial = {}
+        for i in range(start, end):
+            code = codes[i]
+            if code < 0 or not live[i]:
+                continue
+            entry = partial.get(code)
+            if entry is None:
+                partial[code] = [amounts[i], 1]
+            else:
+                entry[0] += amounts[i]
+                entry[1] += 1
+    return report, partial, time.perf_counter() - started
+
+def _merge(partials, names):
+    merged = {}
+    for partial in partials:
+        for code, (total, count) in partial.items():
+            entry = merged.setdefault(names[code], [0.0, 0])
+            entry[0] += total
+            entry[1] += count
+    return merged
+
+def _batch_rows(name, partials, ledger, data_manager, flags):
+    if name == "suspicious":
+        yield ["Transaction ID", "Customer ID", "Amount", "Timestamp", "Staff Username", "Rules"]
+        for i in sorted(i for partial in partials for i in partial):
+            txn = data_manager.get_transaction(ledger.ids[i])
+            if txn is not None:  # deleted since the snapshot
+                yield [txn["id"], txn["customer_id"], txn["amount"], txn.get("timestamp"),
+                       txn.get("staff_username"), ", ".join(flags[txn["id"]])]
+        return
+    names = {"customer_totals": ledger.customer_ids, "staff_activity": ledger.staff_names,
+             "daily_volumes": ledger.days}[name]
+    merged = sorted(_merge(partials, names).items())
+    if name == "customer_totals":
+        yield ["Customer ID", "Name", "Total Amount", "Transactions"]
+        for cid, (total, count) in merged:
+            customer = data_manager.customers.get(cid) or {}
+            yield [cid, customer.get("name", "Unknown"), total, count]
+    elif name == "staff_activity":
+        yield ["Staff Username", "Total Amount", "Transactions"]
+        for staff, (total, count) in merged:
+            yield [staff, total, count]
+    elif name == "daily_volumes":
+        yield ["Date", "Total Amount", "Transactions"]
+        for day, (total, count) in merged:
+            yield [day, total, count]
+
+def run_batch_reports(data_manager, out_dir=REPORTS_DIR, workers=None, chunk_size=50000):
+    wall_started = time.perf_counter()
+    # The suspicious report lists what the fraud engine flagged, the same
+    # transactions the dashboard counts
+    fraud = data_manager.fraud()
+    ledger = data_manager.columnar_snapshot()
+    with data_manager.lock:
+        flags = dict(fraud.flags)
+    flagged = array("b", bytes(len(ledger.ids)))
+    for txn_id in flags:
+        row = ledger.index(txn_id)
+        if row is not None:
+            flagged[row] = 1
+    shared = (
+        {"customer_totals": ledger.customer_codes, "staff_activity": ledger.staff_codes,
+         "daily_volumes": ledger.day_codes},
+        ledger.amounts,
+        ledger.live,
+        flagged,
+    )
+    rows = len(ledger.ids)
+    ranges = [(start, min(start + chunk_size, rows)) for start in range(0, rows, chunk_size)] or [(0, 0)]
+
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else None)
+
+    partials = {name: [] for name in BATCH_REPORTS}
+    timings = {name: 0.0 for name in BATCH_REPORTS}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                                initializer=_init_worker,
+                                                initargs=(shared,)) as pool:
+        futures = [pool.submit(_compute_partial, name, start, end)
+                   for name in BATCH_REPORTS for start, end in ranges]
+        for future in concurrent.futures.as_completed(futures):
+            name, partial, elapsed = future.result()
+            partials[name].append(partial)
+            timings[name] += elapsed
+
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {}
+    for name in BATCH_REPORTS:
+        started = time.perf_counter()
+        paths[name] = report_path(out_dir, prefix=name)
+        with open(paths[name], mode="x", newline="") as file:
+            csv.writer(file).writerows(_batch_rows(name, partials[name], ledger, data_manager, flags))
+        timings[name] += time.perf_counter() - started
+
+    return {"paths": paths, "timings": timings, "wall_time": time.perf_counter() - wall_started,
+            "partitions": len(ranges)}
+
+
+if __name__ == "__main__":
+    import argparse
+    from data_manager import open_data_manager
+
+    parser = argparse.ArgumentParser(description="Generate the compliance batch reports")
+    parser.add_argument("--out-dir", default=REPORTS_DIR)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=50000)
+    args = parser.parse_args()
+
+    data_manager = open_data_manager()
+    try:
+        result = run_batch_reports(data_manager, args.out_dir, args.workers, args.chunk_size)
+    finally:
+        data_manager.close()
+    for name in BATCH_REPORTS:
+        print(f"{name:16} {result['timings'][name]:8.3f}s  {result['paths'][name]}")
+    print(f"{'wall time':16} {result['wall_time']:8.3f}s  ({result['partitions']} partitions)")
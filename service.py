@@ -0,0 +1,317 @@
+import datetime, threading
+from utils import Utils, DecryptCache
+from constants import REPORTS_DIR
+
+class ServiceError(ValueError):
+    # A rejected operation; the message is meant for the user
+    pass
+
+
+def role_for(username):
+    return "admin" if username == "admin" else "staff"
+
+
+class FinSecureService:
+    # The business operations of the application, with no GUI dependency.
+    # Methods validate their input, apply the change through the DataManager
+    # and raise ServiceError when it is rejected. Audit actions are queued and
+    # written by commit() after the data is flushed, so the GUI can run
+    # commit() on its persistence thread while scripts call it inline.
+    # Decrypted contacts and credentials are kept in `secrets` until logout().
+    def __init__(self, data_manager, logger, username=None, secrets=None):
+        self.data = data_manager
+        self.logger = logger
+        self.username = username
+        self.role = role_for(username) if username else None
+        self.secrets = DecryptCache() if secrets is None else secrets
+        self._audit = []
+        self._dashboard = False
+        self._lock = threading.Lock()
+
+    def authenticate(self, username, password):
+        # Returns the user's role and makes them the acting user, or None
+        if username not in self.data.credentials or \
+                self.secrets.get(("credential", username), self.data.credentials[username]) != password:
+            return None
+        self.username = username
+        self.role = role_for(username)
+        return self.role
+
+    def logout(self):
+        # Call once the queued commits have run; they are audited as this user
+        self.secrets.clear()
+        self.username = None
+        self.role = None
+
+    def require_admin(self):
+        if self.role != "admin":
+            raise ServiceError("This action requires an admin account")
+
+    def _record(self, action=None, dashboard=False):
+        with self._lock:
+            if action:
+                self._audit.append(action)
+            self._dashboard = self._dashboard or dashboard
+
+    def commit(self):
+        # Persists everything changed so far, then writes the queued audit
+        # entries; returns them
+        with self._lock:
+            actions, self._audit = self._audit, []
+            dashboard, self._dashboard = self._dashboard, False
+        self.data.flush()
+        if dashboard:
+            self.data.save_dashboard()
+        for action in actions:
+            self.logger.add(action, username=self.username)
+        return actions
+
+    # Customers and accounts
+    def add_customer(self, name, contact, staff_username=None, staff_password=None):
+        self.require_admin()
+        if not all([name, contact]):
+            raise ServiceError("Full Name and Contact Info are required")
+        create_staff = staff_username is not None or staff_password is not None
+        if create_staff and not all([staff_username, staff_password]):
+            raise ServiceError("Username and Password are required for staff accounts")
+        if create_staff and staff_username in self.data.credentials:
+            raise ServiceError("Username already exists")
+
+        cid = str(len(self.data.customers) + 1)
+        self.data.add_customer(cid, {
+            "name": name,
+            "contact": Utils.encrypt(contact),
+            "created_at": str(datetime.datetime.now()),
+            "is_staff": create_staff,
+            "username": staff_username if create_staff else None
+        })
+        self.secrets.invalidate(("contact", cid))
+        if create_staff:
+            self.data.set_credential(staff_username, Utils.encrypt(staff_password))
+            self.secrets.invalidate(("credential", staff_username))
+        self._record(f"Customer added: {name}" + (" (staff account)" if create_staff else ""))
+        return cid
+
+    def sign_up(self, username, password, name, contact="", role="staff"):
+        if not all([username, password, name]):
+            raise ServiceError("Username, Password and Full Name are required")
+        if username in self.data.credentials:
+            raise ServiceError("Username already exists")
+        self.data.set_credential(username, Utils.encrypt(password))
+        self.secrets.invalidate(("credential", username))
+        cid = None
+        if role == "staff":
+            # Staff accounts get a customer record
+            cid = str(len(self.data.customers) + 1)
+            self.data.add_customer(cid, {
+                "name": name,
+                "contact": Utils.encrypt(contact) if contact else Utils.encrypt(""),
+                "created_at": str(datetime.datetime.now()),
+                "is_staff": True,
+                "username": username
+            })
+            self.secrets.invalidate(("contact", cid))
+        self._record()
+        return cid
+
+    def customer_row(self, cid):
+        customer = self.data.customers[cid]
+        return (cid, customer["name"], self.secrets.get(("contact", cid), customer["contact"]))
+
+    # Transactions
+    def add_transaction(self, cid, amount):
+        # Returns (txn, names of the fraud rules it trips)
+        try:
+            amount = float(amount)
+        except (TypeError, ValueError):
+            raise ServiceError("Invalid amount") from None
+        if cid not in self.data.customers or not amount:
+            raise ServiceError("Invalid customer ID or amount")
+        txn = {
+            "customer_id": cid,
+            "amount": amount,
+            "timestamp": str(datetime.datetime.now()),
+            "staff_username": self.username  # Track which staff member created this
+        }
+        self.data.add_transaction(txn)
+        self._record(f"Transaction added for customer {cid}: {amount} by {self.username}",
+                     dashboard=True)
+        return txn, self.data.fraud().reasons(txn["id"])
+
+    def edit_transaction(self, cid, timestamp, amount):
+        try:
+            amount = float(amount)
+        except (TypeError, ValueError):
+            raise ServiceError("Invalid amount") from None
+        if not self.data.update_transaction(cid, timestamp, amount):
+            raise ServiceError("Transaction not found")
+        self._record()
+
+    def delete_transaction(self, cid, timestamp):
+        if not self.data.delete_transaction(cid, timestamp):
+            raise ServiceError("Transaction not found")
+        self._record()
+
+    def my_transactions(self):
+        return self.data.transactions_for_staff(self.username)
+
+    def import_transactions(self, path, fmt=None, batch_size=10000):
+        # Commits and audits once per batch itself
+        self.require_admin()
+        from bulk_import import BulkImporter
+        try:
+            return BulkImporter(self.data, self.logger, self.username, batch_size).run(path, fmt)
+        except (ValueError, OSError) as e:
+            # Unsupported format or unreadable file; batches before it are kept
+            raise ServiceError(f"Import failed: {e}") from None
+
+    # Dashboards, reports and audit
+    def stats(self):
+        aggregates = self.data.aggregates
+        if self.role == "admin":
+            return {"customers": len(self.data.customers), "count": aggregates.count,
+                    "total": aggregates.total, "suspicious": len(self.data.fraud())}
+        return {"count": aggregates.staff_count(self.username),
+                "total": aggregates.staff_total(self.username),
+                "recent": len(self.my_transactions()[-5:])}
+
+    def report_job(self, out_dir=REPORTS_DIR):
+        # Not started; the caller runs it inline or on a thread and calls
+        # report_done() when it finishes
+        self.require_admin()
+        from reports import ReportJob  # keeps the login path free of the report imports
+        return ReportJob(self.data, out_dir, self.secrets)
+
+    def report_done(self):
+        self._record("Admin generated report")
+
+    def generate_report(self, out_dir=REPORTS_DIR):
+        job = self.report_job(out_dir)
+        path = job.run()
+        while path is None:
+            event, value, _ = job.events.get_nowait()
+            if event == "error":
+                raise ServiceError(f"Report failed: {value}")
+        self.report_done()
+        return path
+
+    def generate_batch_reports(self, out_dir=REPORTS_DIR, workers=None):
+        self.require_admin()
+        from reports import run_batch_reports
+        result = run_batch_reports(self.data, out_dir, workers)
+        self._record("Admin generated batch reports")
+        return result
+
+    def audit_log(self, start=None, end=None, username=None, text=None, limit=100, cursor=None):
+        self.require_admin()
+        return self.logger.query(start=start, end=end, username=username, text=text,
+                                 limit=limit, cursor=cursor)
+
+
+def main(argv=None):
+    import argparse, getpass, os, sys
+    from data_manager import open_data_manager
+    from audit_logger import AuditLogger
+
+    parser = argparse.ArgumentParser(
+        description="FinSecure without the GUI. The password is read from FINSECURE_PASSWORD "
+                    "or prompted for.")
+    parser.add_argument("--user", required=True)
+    commands = parser.add_subparsers(dest="command", required=True)
+    add_customer = commands.add_parser("add-customer")
+    add_customer.add_argument("name")
+    add_customer.add_argument("contact")
+    add_customer.add_argument("--staff-username")
+    add_customer.add_argument("--staff-password")
+    add_txn = commands.add_parser("add-transaction")
+    add_txn.add_argument("customer_id")
+    add_txn.add_argument("amount")
+    edit_txn = commands.add_parser("edit-transaction")
+    edit_txn.add_argument("customer_id")
+    edit_txn.add_argument("timestamp")
+    edit_txn.add_argument("amount")
+    delete_txn = commands.add_parser("delete-transaction")
+    delete_txn.add_argument("customer_id")
+    delete_txn.add_argument("timestamp")
+    commands.add_parser("customers")
+    commands.add_parser("my-transactions")
+    commands.add_parser("stats")
+    report = commands.add_parser("report")
+    report.add_argument("--out-dir", default=REPORTS_DIR)
+    batch = commands.add_parser("batch-reports")
+    batch.add_argument("--out-dir", default=REPORTS_DIR)
+    batch.add_argument("--workers", type=int, default=None)
+    bulk = commands.add_parser("import")
+    bulk.add_argument("file")
+    bulk.add_argument("--format", choices=("csv", "jsonl"), default=None)
+    bulk.add_argument("--batch-size", type=int, default=10000)
+    audit = commands.add_parser("audit")
+    audit.add_argument("--from", dest="start")
+    audit.add_argument("--to", dest="end")
+    audit.add_argument("--username")
+    audit.add_argument("--contains")
+    audit.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    password = os.environ.get("FINSECURE_PASSWORD") or getpass.getpass()
+    data_manager = logger = None
+    try:
+        try:
+            data_manager = open_data_manager()
+        except (ValueError, OSError) as e:
+            raise ServiceError(f"Could not load the data files: {e}") from None
+        logger = AuditLogger()
+        service = FinSecureService(data_manager, logger)
+        if service.authenticate(args.user, password) is None:
+            print("Invalid credentials", file=sys.stderr)
+            return 1
+        if args.command == "add-customer":
+            print(service.add_customer(args.name, args.contact, args.staff_username,
+                                       args.staff_password))
+        elif args.command == "add-transaction":
+            txn, reasons = service.add_transaction(args.customer_id, args.amount)
+            print(f"{txn['id']} {txn['timestamp']}" +
+                  (f"  SUSPICIOUS ({', '.join(reasons)})" if reasons else ""))
+        elif args.command == "edit-transaction":
+            service.edit_transaction(args.customer_id, args.timestamp, args.amount)
+        elif args.command == "delete-transaction":
+            service.delete_transaction(args.customer_id, args.timestamp)
+        elif args.command == "customers":
+            service.require_admin()
+            for cid in data_manager.customers:
+                print("\t".join(service.customer_row(cid)))
+        elif args.command == "my-transactions":
+            for txn in service.my_transactions():
+                print(f"{txn['customer_id']}\t{txn['amount']}\t{txn.get('timestamp')}")
+        elif args.command == "stats":
+            for name, value in service.stats().items():
+                print(f"{name:12} {value}")
+        elif args.command == "report":
+            print(service.generate_report(args.out_dir))
+        elif args.command == "batch-reports":
+            result = service.generate_batch_reports(args.out_dir, args.workers)
+            for name, path in result["paths"].items():
+                print(f"{name:16} {result['timings'][name]:8.3f}s  {path}")
+        elif args.command == "import":
+            result = service.import_transactions(args.file, args.format, args.batch_size)
+            print(f"{result['imported']} imported, {result['rejected']} rejected, "
+                  f"{result['suspicious']} suspicious, {result['rows_per_sec']:,.0f} rows/sec")
+        elif args.command == "audit":
+            entries, _ = service.audit_log(args.start, args.end, args.username, args.contains,
+                                           args.limit)
+            for entry in entries:
+                print(f"{entry['timestamp']} - {entry['action']}")
+        service.commit()
+    except ServiceError as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        if data_manager is not None:
+            data_manager.close()
+        if logger is not None:
+            logger.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
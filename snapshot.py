@@ -0,0 +1,322 @@
+import array, json, mmap, os, struct, sys, time
+from utils import Utils
+from json_stream import iter_json
+from constants import SNAPSHOT_FILE, CUSTOMERS_FILE, TRANSACTIONS_FILE
+
+# Binary snapshot of the customer and transaction stores. Layout, all
+# little-endian:
+#
+#   header       "FSNP", u16 version, u16 reserved
+#   3 sections   u64 byte length, then the payload:
+#     strings       u32 count, u32 char offsets[count + 1], UTF-8 text
+#     customers     u32 count, u32 columns id, name, contact, created_at,
+#                   username, extra, txn_count; u32 txn_ids[sum(txn_count)];
+#                   u8 is_staff[count]
+#     transactions  u32 count, f64 amount[count], u32 columns customer_id, id,
+#                   timestamp, staff_username, extra
+#
+# String columns hold references into the string table, so a customer id or
+# username repeated across the ledger is stored once: 0 means the key is
+# absent from the record, 1 means null, n >= 2 is string n - 2. `extra` is
+# the JSON of any keys that don't fit the fixed columns. Columns are read
+# with array.frombytes() straight from the memory-mapped file.
+MAGIC = b"FSNP"
+VERSION = 1
+_HEADER = struct.Struct("<4sHH")
+_LENGTH = struct.Struct("<Q")
+_COUNT = struct.Struct("<I")
+MISSING, NULL = 0, 1
+# is_staff is one byte: absent, null, false, true
+_STAFF_FLAGS = (MISSING, None, False, True)
+_ABSENT = object()
+CUSTOMER_FIELDS = ("name", "contact", "created_at", "username")
+TXN_FIELDS = ("customer_id", "id", "timestamp", "staff_username")
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def _le(column):
+    if sys.byteorder == "big":
+        column = array.array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+class _StringTable:
+    def __init__(self):
+        self.refs = {}
+        self.strings = []
+
+    def ref(self, value):
+        if value is None:
+            return NULL
+        ref = self.refs.get(value)
+        if ref is None:
+            ref = self.refs[value] = len(self.strings) + 2
+            self.strings.append(value)
+        return ref
+
+    def columns(self, record, fields, columns):
+        # Appends one reference per field; keys that are not strings (or
+        # null) and keys outside `fields` go to the extra JSON
+        extra = {}
+        for key, value in record.items():
+            if key not in fields:
+                extra[key] = value
+        for field, column in zip(fields, columns):
+            if field not in record:
+                column.append(MISSING)
+            elif record[field] is None or isinstance(record[field], str):
+                column.append(self.ref(record[field]))
+            else:
+                column.append(MISSING)
+                extra[field] = record[field]
+        return self.ref(json.dumps(extra)) if extra else MISSING
+
+    def encode(self):
+        offsets = array.array("I", [0])
+        for value in self.strings:
+            offsets.append(offsets[-1] + len(value))
+        return (_COUNT.pack(len(self.strings)) + _le(offsets)
+                + "".join(self.strings).encode("utf-8"))
+
+
+def dumps(customers, transactions):
+    """Serializes the stores to snapshot bytes."""
+    table = _StringTable()
+
+    ids, is_staff, txn_counts, txn_ids = array.array("I"), array.array("B"), \
+        array.array("I"), array.array("I")
+    columns = [array.array("I") for _ in CUSTOMER_FIELDS]
+    extras = array.array("I")
+    for cid, customer in customers.items():
+        ids.append(table.ref(cid))
+        fields = dict(customer)
+        flag = fields.pop("is_staff", _ABSENT)
+        if flag is None or flag is False or flag is True:
+            is_staff.append(_STAFF_FLAGS.index(flag, 1))
+        else:
+            is_staff.append(MISSING)
+            if flag is not _ABSENT:
+                fields["is_staff"] = flag
+        refs = [table.ref(txn_id) for txn_id in fields.pop("txn_ids", [])]
+        txn_counts.append(len(refs))
+        txn_ids.extend(refs)
+        extras.append(table.columns(fields, CUSTOMER_FIELDS, columns))
+    customer_section = b"".join([_COUNT.pack(len(ids)), _le(ids)] +
+                                [_le(c) for c in columns] +
+                                [_le(extras), _le(txn_counts), _le(txn_ids), is_staff.tobytes()])
+
+    amounts = array.array("d")
+    columns = [array.array("I") for _ in TXN_FIELDS]
+    extras = array.array("I")
+    for txn in transactions:
+        fields = dict(txn)
+        amount = fields.pop("amount")
+        amounts.append(amount)
+        if not isinstance(amount, float):
+            # Ints are stored as f64; keep the exact JSON value alongside
+            fields["amount"] = amount
+        extras.append(table.columns(fields, TXN_FIELDS, columns))
+    txn_section = b"".join([_COUNT.pack(len(amounts)), _le(amounts)] +
+                           [_le(c) for c in columns] + [_le(extras)])
+
+    parts = [_HEADER.pack(MAGIC, VERSION, 0)]
+    for section in (table.encode(), customer_section, txn_section):
+        parts.append(_LENGTH.pack(len(section)))
+        parts.append(section)
+    return b"".join(parts)
+
+
+class _Reader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def section(self):
+        (length,) = _LENGTH.unpack_from(self.data, self.pos)
+        self.pos += _LENGTH.size
+        end = self.pos + length
+        if end > len(self.data):
+            raise SnapshotError("snapshot is truncated")
+        return end
+
+    def count(self):
+        (count,) = _COUNT.unpack_from(self.data, self.pos)
+        self.pos += _COUNT.size
+        return count
+
+    def column(self, typecode, count):
+        column = array.array(typecode)
+        end = self.pos + column.itemsize * count
+        if end > len(self.data):
+            raise SnapshotError("snapshot is truncated")
+        column.frombytes(self.data[self.pos:end])
+        if sys.byteorder == "big":
+            column.byteswap()
+        self.pos = end
+        return column
+
+
+def loads(data):
+    """Returns (customers, transactions) from snapshot bytes or an mmap."""
+    if len(data) < _HEADER.size:
+        raise SnapshotError("not a snapshot file")
+    magic, version, _ = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise SnapshotError("not a snapshot file")
+    if version != VERSION:
+        raise SnapshotError(f"unsupported snapshot version {version}")
+    reader = _Reader(data)
+    reader.pos = _HEADER.size
+
+    end = reader.section()
+    offsets = reader.column("I", reader.count() + 1)
+    text = bytes(data[reader.pos:end]).decode("utf-8")
+    # Index 0 and 1 are the absent/null markers
+    strings = [MISSING, None] + [text[a:b] for a, b in zip(offsets, offsets[1:])]
+    reader.pos = end
+
+    end = reader.section()
+    count = reader.count()
+    ids = reader.column("I", count)
+    names, contacts, created, usernames, extras, txn_counts = \
+        [reader.column("I", count) for _ in range(6)]
+    txn_ids = reader.column("I", sum(txn_counts))
+    is_staff = reader.column("B", count)
+    customers = {}
+    start = 0
+    for i, cid in enumerate(ids):
+        customer = {}
+        for field, ref in (("name", names[i]), ("contact", contacts[i]),
+                           ("created_at", created[i]), ("username", usernames[i])):
+            if ref:
+                customer[field] = strings[ref]
+        if is_staff[i]:
+            customer["is_staff"] = _STAFF_FLAGS[is_staff[i]]
+        if extras[i]:
+            customer.update(json.loads(strings[extras[i]]))
+        customer["txn_ids"] = [strings[ref] for ref in txn_ids[start:start + txn_counts[i]]]
+        start += txn_counts[i]
+        customers[strings[cid]] = customer
+    reader.pos = end
+
+    end = reader.section()
+    count = reader.count()
+    amounts = reader.column("d", count)
+    customer_ids, txn_ids, timestamps, staff, extras = [reader.column("I", count) for _ in range(5)]
+    transactions = []
+    for amount, cid, txn_id, ts, username, extra in zip(amounts, customer_ids, txn_ids,
+                                                        timestamps, staff, extras):
+        txn = {"customer_id": strings[cid], "amount": amount}
+        if ts:
+            txn["timestamp"] = strings[ts]
+        if username:
+            txn["staff_username"] = strings[username]
+        if txn_id:
+            txn["id"] = strings[txn_id]
+        if extra:
+            txn.update(json.loads(strings[extra]))
+        transactions.append(txn)
+    return customers, transactions
+
+
+def load(filename):
+    with open(filename, "rb") as file, \
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return loads(data)
+
+
+def save(filename, customers, transactions):
+    Utils.atomic_write(filename, dumps(customers, transactions))
+
+
+# JSON interoperability
+def import_json(snapshot_file=SNAPSHOT_FILE, customers_file=CUSTOMERS_FILE,
+                transactions_file=TRANSACTIONS_FILE):
+    customers = dict(iter_json(customers_file))
+    transactions = list(iter_json(transactions_file))
+    save(snapshot_file, customers, transactions)
+    return len(customers), len(transactions)
+
+
+def export_json(snapshot_file=SNAPSHOT_FILE, customers_file=CUSTOMERS_FILE,
+                transactions_file=TRANSACTIONS_FILE):
+    customers, transactions = load(snapshot_file)
+    Utils.save_json(customers_file, customers)
+    Utils.save_json(transactions_file, transactions)
+    return len(customers), len(transactions)
+
+
+def benchmark(snapshot_file, customers_file, transactions_file, repeat=3):
+    # Best-of-`repeat` wall time for each way of loading the same stores
+    paths = {
+        "json.load": lambda: (Utils.load_json(customers_file, {}),
+                              Utils.load_json(transactions_file, [])),
+        "json stream": lambda: (dict(iter_json(customers_file)), list(iter_json(transactions_file))),
+        "snapshot": lambda: load(snapshot_file),
+    }
+    timings = {}
+    for name, load_stores in paths.items():
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            load_stores()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = best
+    return timings
+
+
+def _generate(directory, count):
+    customers = {str(i): {"name": f"Customer {i}", "contact": Utils.encrypt(f"c{i}@example.com"),
+                          "created_at": "2024-01-01 00:00:00", "is_staff": False, "username": None,
+                          "txn_ids": []} for i in range(1, count // 20 + 2)}
+    transactions = []
+    for i in range(count):
+        cid = str(i % len(customers) + 1)
+        txn = {"customer_id": cid, "amount": float(i % 20000), "id": f"{i:032x}",
+               "timestamp": f"2024-01-01 00:00:{i % 60:02d}.{i:06d}",
+               "staff_username": f"staff{i % 7}"}
+        customers[cid]["txn_ids"].append(txn["id"])
+        transactions.append(txn)
+    paths = (os.path.join(directory, "customers.json"), os.path.join(directory, "transactions.json"))
+    Utils.save_json(paths[0], customers)
+    Utils.save_json(paths[1], transactions)
+    return paths
+
+
+if __name__ == "__main__":
+    import argparse, tempfile
+
+    parser = argparse.ArgumentParser(description="Binary snapshot of the data stores")
+    parser.add_argument("command", choices=("import", "export", "bench"))
+    parser.add_argument("--snapshot", default=SNAPSHOT_FILE)
+    parser.add_argument("--customers", default=CUSTOMERS_FILE)
+    parser.add_argument("--transactions", default=TRANSACTIONS_FILE)
+    parser.add_argument("--generate", type=int, default=0,
+                        help="bench: use this many synthetic transactions instead of the data files")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == "import":
+        print("imported %d customers, %d transactions" %
+              import_json(args.snapshot, args.customers, args.transactions))
+    elif args.command == "export":
+        print("exported %d customers, %d transactions" %
+              export_json(args.snapshot, args.customers, args.transactions))
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            customers_file, transactions_file = args.customers, args.transactions
+            snapshot_file = os.path.join(directory, "bench.snap")
+            if args.generate:
+                customers_file, transactions_file = _generate(directory, args.generate)
+            import_json(snapshot_file, customers_file, transactions_file)
+            sizes = {"json": os.path.getsize(customers_file) + os.path.getsize(transactions_file),
+                     "snapshot": os.path.getsize(snapshot_file)}
+            print(f"size: json {sizes['json']:,} bytes, snapshot {sizes['snapshot']:,} bytes")
+            for name, elapsed in benchmark(snapshot_file, customers_file, transactions_file,
+                                           args.repeat).items():
+                print(f"{name:12} {elapsed * 1000:10.1f} ms")
@@ -0,0 +1,395 @@
+import json, sqlite3, threading, uuid
+from collections.abc import MutableMapping, Sequence
+from data_manager import DataManager
+from columnar import ColumnarLedger
+from aggregates import DashboardAggregates
+from constants import DATABASE_FILE, JOURNAL_FILE, SNAPSHOT_FILE
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS customers (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    contact TEXT,
+    created_at TEXT,
+    is_staff INTEGER NOT NULL DEFAULT 0,
+    username TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS customers_username ON customers (username);
+CREATE TABLE IF NOT EXISTS transactions (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    customer_id TEXT NOT NULL,
+    amount REAL NOT NULL,
+    timestamp TEXT,
+    staff_username TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS transactions_customer ON transactions (customer_id, timestamp);
+CREATE INDEX IF NOT EXISTS transactions_staff ON transactions (staff_username, seq);
+CREATE TABLE IF NOT EXISTS credentials (
+    username TEXT PRIMARY KEY,
+    secret TEXT NOT NULL
+);
+"""
+
+CUSTOMER_FIELDS = ("name", "contact", "created_at", "is_staff", "username")
+TXN_FIELDS = ("id", "customer_id", "amount", "timestamp", "staff_username")
+TXN_COLUMNS = ", ".join(TXN_FIELDS) + ", extra"
+
+
+def _extra(record, fields):
+    # Keys outside the fixed columns are kept as JSON so records round-trip
+    extra = {k: v for k, v in record.items() if k not in fields and k != "txn_ids"}
+    return json.dumps(extra) if extra else None
+
+def _txn_row(txn):
+    return (txn["id"], txn["customer_id"], txn["amount"], txn.get("timestamp"),
+            txn.get("staff_username"), _extra(txn, TXN_FIELDS))
+
+def _txn_record(row):
+    txn = {field: value for field, value in zip(TXN_FIELDS, row) if value is not None}
+    if row[-1]:
+        txn.update(json.loads(row[-1]))
+    return txn
+
+def _customer_row(cid, record):
+    return (cid, record.get("name"), record.get("contact"), record.get("created_at"),
+            int(bool(record.get("is_staff"))), record.get("username"),
+            _extra(record, CUSTOMER_FIELDS))
+
+
+class _CustomersView(MutableMapping):
+    # The customers table as a dict of cid -> record. Records are built on
+    # access, with txn_ids read from the transactions index, so changing a
+    # returned record does not change the database; go through DataManager.
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, cid):
+        rows = self.store._query(
+            "SELECT name, contact, created_at, is_staff, username, extra FROM customers WHERE id = ?",
+            (cid,))
+        if not rows:
+            raise KeyError(cid)
+        row = rows[0]
+        record = dict(zip(CUSTOMER_FIELDS, row))
+        record["is_staff"] = bool(record["is_staff"])
+        if row[-1]:
+            record.update(json.loads(row[-1]))
+        record["txn_ids"] = [txn_id for (txn_id,) in self.store._query(
+            "SELECT id FROM transactions WHERE customer_id = ? ORDER BY seq", (cid,))]
+        return record
+
+    def __contains__(self, cid):
+        return bool(self.store._query("SELECT 1 FROM customers WHERE id = ?", (cid,)))
+
+    def __setitem__(self, cid, record):
+        self.store._execute(
+            "INSERT OR REPLACE INTO customers VALUES (?, ?, ?, ?, ?, ?, ?)", _customer_row(cid, record))
+
+    def __delitem__(self, cid):
+        if not self.store._execute("DELETE FROM customers WHERE id = ?", (cid,)).rowcount:
+            raise KeyError(cid)
+
+    def __iter__(self):
+        return (cid for (cid,) in self.store._batches("SELECT rowid, id FROM customers", "rowid"))
+
+    def __len__(self):
+        return self.store._query("SELECT COUNT(*) FROM customers")[0][0]
+
+
+class _CredentialsView(MutableMapping):
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, username):
+        rows = self.store._query("SELECT secret FROM credentials WHERE username = ?", (username,))
+        if not rows:
+            raise KeyError(username)
+        return rows[0][0]
+
+    def __contains__(self, username):
+        return bool(self.store._query("SELECT 1 FROM credentials WHERE username = ?", (username,)))
+
+    def __setitem__(self, username, secret):
+        self.store._execute("INSERT OR REPLACE INTO credentials VALUES (?, ?)", (username, secret))
+
+    def __delitem__(self, username):
+        if not self.store._execute("DELETE FROM credentials WHERE username = ?", (username,)).rowcount:
+            raise KeyError(username)
+
+    def __iter__(self):
+        return (u for (u,) in self.store._batches("SELECT rowid, username FROM credentials", "rowid"))
+
+    def __len__(self):
+        return self.store._query("SELECT COUNT(*) FROM credentials")[0][0]
+
+
+class _TransactionsView(Sequence):
+    # The ledger as a read-only list in insertion order. Iteration pages
+    # through the table, so scanning it never holds more than one batch.
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        return self.store._query("SELECT COUNT(*) FROM transactions")[0][0]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return [_txn_record(row) for row in self.store._query(
+                f"SELECT {TXN_COLUMNS} FROM transactions ORDER BY seq LIMIT ? OFFSET ?",
+                (max(0, stop - start), start))]
+        if index < 0:
+            index += len(self)
+        rows = self.store._query(
+            f"SELECT {TXN_COLUMNS} FROM transactions ORDER BY seq LIMIT 1 OFFSET ?", (index,)) \
+            if index >= 0 else []
+        if not rows:
+            raise IndexError("transaction index out of range")
+        return _txn_record(rows[0])
+
+    def __iter__(self):
+        for row in self.store._batches(f"SELECT seq, {TXN_COLUMNS} FROM transactions", "seq"):
+            yield _txn_record(row)
+
+    def append(self, txn):
+        # Like appending to the JSON ledger: no listeners, no customer check
+        txn.setdefault("id", uuid.uuid4().hex)
+        self.store._execute(f"INSERT INTO transactions ({TXN_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+                            _txn_row(txn))
+
+
+class SQLiteDataManager(DataManager):
+    # DataManager backed by a SQLite database in WAL mode instead of JSON
+    # files. customers, transactions and credentials are views over indexed
+    # tables, so nothing is loaded up front and lookups are index queries.
+    # Changes accumulate in an open SQLite transaction that flush() commits;
+    # WAL takes the place of the JSON journal.
+    BATCH = 1000
+
+    def __init__(self, db_file=None, lazy=False):
+        self.db_file = db_file or DATABASE_FILE
+        super().__init__(lazy=lazy)
+
+    def _open(self, lazy):
+        # One connection shared by all threads; every use holds self.lock
+        self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.executescript(SCHEMA)
+        self.credentials = _CredentialsView(self)
+        self._customers = _CustomersView(self)
+        self._transactions = _TransactionsView(self)
+        if lazy:
+            self._loader = threading.Thread(target=self._load_in_background, daemon=True)
+        else:
+            self._load_stores()
+
+    def _load_stores(self):
+        # The dashboard totals are computed at startup with GROUP BY queries.
+        # The histogram and the fraud backfill read flat columns (amounts;
+        # ids, customers, amounts and times) in keyset batches, so no
+        # record is built and the columns are dropped once scored.
+        try:
+            aggregates = DashboardAggregates()
+            aggregates.count, aggregates.total, suspicious = self._query(
+                "SELECT COUNT(*), TOTAL(amount), SUM(amount > ?) FROM transactions",
+                (aggregates.threshold,))[0]
+            aggregates.suspicious = suspicious or 0
+            aggregates.per_customer = dict(self._query(
+                "SELECT customer_id, TOTAL(amount) FROM transactions GROUP BY customer_id"))
+            for staff, total, count in self._query(
+                    "SELECT staff_username, TOTAL(amount), COUNT(*) FROM transactions "
+                    "WHERE staff_username IS NOT NULL GROUP BY staff_username"):
+                aggregates.per_staff[staff] = total
+                aggregates.staff_counts[staff] = count
+            self.aggregates = aggregates
+            self.add_listener(self.aggregates)
+            self._build_histogram()
+            self._build_fraud_engine()
+        except Exception as e:
+            self._load_error = e
+            raise
+        finally:
+            self._loaded.set()
+
+    def _query(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def _execute(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params)
+
+    def _batches(self, select, key):
+        # Keyset pagination on `key` (the first selected column, which is
+        # dropped from the yielded rows). The lock is only held per batch.
+        last = None
+        while True:
+            if last is None:
+                rows = self._query(f"{select} ORDER BY {key} LIMIT ?", (self.BATCH,))
+            else:
+                rows = self._query(f"{select} WHERE {key} > ? ORDER BY {key} LIMIT ?",
+                                   (last, self.BATCH))
+            for row in rows:
+                yield row[1:]
+            if len(rows) < self.BATCH:
+                return
+            last = rows[-1][0]
+
+    # Lookups, answered from the table indexes
+    def get_transaction(self, txn_id):
+        rows = self._query(f"SELECT {TXN_COLUMNS} FROM transactions WHERE id = ?", (txn_id,))
+        return _txn_record(rows[0]) if rows else None
+
+    def find_transaction(self, cid, timestamp):
+        rows = self._query(f"SELECT {TXN_COLUMNS} FROM transactions "
+                           "WHERE customer_id = ? AND timestamp IS ? ORDER BY seq DESC LIMIT 1",
+                           (cid, timestamp))
+        return _txn_record(rows[0]) if rows else None
+
+    def amounts(self):
+        return [row[0] for row in self._query("SELECT amount FROM transactions")]
+
+    def columnar(self):
+        # Not kept in memory: the table is the store, so each call reads a
+        # fresh copy of its columns, one batch at a time
+        ledger = ColumnarLedger()
+        for row in self._batches("SELECT seq, id, customer_id, amount, timestamp, staff_username "
+                                 "FROM transactions", "seq"):
+            ledger.append(*row)
+        return ledger
+
+    def columnar_snapshot(self):
+        return self.columnar()
+
+    def find_transactions(self, cid, timestamp):
+        return [_txn_record(row) for row in self._query(
+            f"SELECT {TXN_COLUMNS} FROM transactions WHERE customer_id = ? AND timestamp IS ? "
+            "ORDER BY seq", (cid, timestamp))]
+
+    def transactions_for_staff(self, username):
+        return [_txn_record(row) for row in self._query(
+            f"SELECT {TXN_COLUMNS} FROM transactions WHERE staff_username = ? ORDER BY seq",
+            (username,))]
+
+    def customer_history(self, cid):
+        return [_txn_record(row) for row in self._query(
+            f"SELECT {TXN_COLUMNS} FROM transactions WHERE customer_id = ? ORDER BY seq", (cid,))]
+
+    def _lookup(self, args):
+        if "id" in args:
+            return self.get_transaction(args["id"])
+        return self.find_transaction(args["customer_id"], args["timestamp"])
+
+    def _op_add_customer(self, args):
+        record = args["record"]
+        record.pop("history", None)
+        self.customers[args["customer_id"]] = record
+        self.mark_dirty("customers", args["customer_id"])
+        return True
+
+    def _op_add_transaction(self, txn):
+        if txn["customer_id"] not in self.customers:
+            return False
+        self.transactions.append(txn)
+        self._notify("on_add", txn)
+        self.mark_dirty("transactions")
+        self.mark_dirty("customers", txn["customer_id"])
+        return True
+
+    def _op_update_transaction(self, args):
+        txn = self._lookup(args)
+        if txn is None:
+            return False
+        old_amount = txn["amount"]
+        txn["amount"] = args["amount"]
+        self._execute("UPDATE transactions SET amount = ? WHERE id = ?", (txn["amount"], txn["id"]))
+        self.mark_dirty("transactions")
+        self._notify("on_update", txn, old_amount)
+        return True
+
+    def _op_delete_transaction(self, args):
+        txn = self._lookup(args)
+        if txn is None:
+            return False
+        self._execute("DELETE FROM transactions WHERE id = ?", (txn["id"],))
+        self.mark_dirty("transactions")
+        self.mark_dirty("customers", txn["customer_id"])
+        self._notify("on_delete", txn)
+        return True
+
+    # Persistence. Every change since the last flush is one SQLite
+    # transaction, committed (and fsynced by SQLite) here.
+    def flush(self):
+        self.ensure_loaded()
+        with self.lock:
+            written = []
+            if self.conn.in_transaction:
+                self.conn.commit()
+                written.append(self.db_file)
+            self._dirty.clear()
+            self.io_stats["flushes"] += 1
+            self.io_stats["files_written"] += len(written)
+            self.io_stats["files_skipped"] += 1 - len(written)
+            return written
+
+    def compact(self):
+        # Commit and fold the WAL back into the main database file
+        with self.lock:
+            written = self.flush()
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            return written
+
+    def save_all(self):
+        return self.compact()
+
+    def close(self):
+        self.ensure_loaded()
+        with self.lock:
+            self.flush()
+            self.conn.close()
+
+
+def import_json(db_file=None, customers_file=None, transactions_file=None, credentials_file=None,
+                journal_file=None, snapshot_file=None):
+    # One-shot migration of the JSON stores (including any journal records not
+    # yet compacted, and the binary snapshot when it holds customers and
+    # transactions) into the database, in a single SQLite transaction.
+    # Existing rows with the same keys are replaced.
+    source = DataManager(customers_file, transactions_file, credentials_file, journal_file,
+                         snapshot_file=snapshot_file)
+    store = SQLiteDataManager(db_file)
+    with store.lock, store.conn:
+        store.conn.executemany("INSERT OR REPLACE INTO customers VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (_customer_row(cid, c) for cid, c in source.customers.items()))
+        store.conn.executemany(f"INSERT OR REPLACE INTO transactions ({TXN_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+                               (_txn_row(txn) for txn in source.transactions))
+        store.conn.executemany("INSERT OR REPLACE INTO credentials VALUES (?, ?)",
+                               source.credentials.items())
+    counts = {"customers": len(source.customers), "transactions": len(source.transactions),
+              "credentials": len(source.credentials)}
+    store.close()
+    if source._journal is not None:
+        source._journal.close()
+    return counts
+
+
+if __name__ == "__main__":
+    import argparse, os
+
+    # The same sources open_data_manager() runs on, so nothing main.py wrote
+    # is left behind
+    parser = argparse.ArgumentParser(description="Import the JSON data files into SQLite")
+    parser.add_argument("--db", default=DATABASE_FILE)
+    parser.add_argument("--journal", default=JOURNAL_FILE)
+    parser.add_argument("--snapshot", default=SNAPSHOT_FILE if os.path.exists(SNAPSHOT_FILE) else None)
+    args = parser.parse_args()
+
+    for name, count in import_json(args.db, journal_file=args.journal,
+                                   snapshot_file=args.snapshot).items():
+        print(f"{name:14} {count}")
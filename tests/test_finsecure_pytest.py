@@ -80,4 +80,827 @@ def test_audit_logger(temp_files):
     
     # Verify persistence
     new_logger = AuditLogger(audit_file=audit_file)
-    assert len(new_logger.log) == initial_count + 1
\ No newline at end of file
+    assert len(new_logger.log) == initial_count + 1
+
+def test_data_manager_journal_replay(temp_files):
+    cust_file, trans_file, cred_file, _ = temp_files
+    journal = cust_file + ".journal"
+    dm = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                     credentials_file=cred_file, journal_file=journal)
+    dm.add_transaction({"customer_id": "1", "amount": 50.0, "timestamp": "t1"})
+    dm.update_transaction("1", "t1", 75.0)
+    dm.set_credential("staff", Utils.encrypt("pw"))
+    dm.close()
+
+    # Snapshot files are untouched; state is rebuilt from the journal
+    assert len(Utils.load_json(trans_file, [])) == 1
+    reloaded = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                           credentials_file=cred_file, journal_file=journal)
+    assert len(reloaded.transactions) == 2
+    assert reloaded.transactions[-1]["amount"] == 75.0
+    assert "staff" in reloaded.credentials
+
+    reloaded.compact()
+    reloaded.close()
+    assert os.path.getsize(journal) == 0
+    again = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                        credentials_file=cred_file, journal_file=journal)
+    assert len(again.transactions) == 2
+    again.close()
+    for f in [journal, journal + ".seq"]:
+        os.unlink(f)
+
+
+def test_journal_edits_to_legacy_rows_survive_restart(temp_files, tmp_path):
+    # Ledger rows and history copies written before transactions had ids
+    cust_file, trans_file, cred_file, _ = temp_files
+    Utils.save_json(trans_file, [{"customer_id": "1", "amount": 50.0, "timestamp": "t1"}])
+    Utils.save_json(cust_file, {"1": {"name": "Test Customer", "history": [
+        {"customer_id": "1", "amount": 30.0, "timestamp": "t2"}]}})
+    journal = str(tmp_path / "journal.jsonl")
+    dm = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                     credentials_file=cred_file, journal_file=journal)
+    assert dm.update_transaction("1", "t1", 999.0)
+    assert dm.delete_transaction("1", "t2")
+    dm.close()
+
+    reopened = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                           credentials_file=cred_file, journal_file=journal)
+    assert [(t["timestamp"], t["amount"]) for t in reopened.transactions] == [("t1", 999.0)]
+    reopened.close()
+
+
+def test_data_manager_flush_writes_only_dirty(temp_files):
+    cust_file, trans_file, cred_file, _ = temp_files
+    dm = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                     credentials_file=cred_file)
+    # Ids assigned on load and the migrated customer history are written back once
+    assert sorted(dm.flush()) == sorted([cust_file, trans_file])
+    assert dm.flush() == []
+
+    dm.set_credential("staff", Utils.encrypt("pw"))
+    assert dm.flush() == [cred_file]
+
+    dm.add_transaction({"customer_id": "1", "amount": 5.0, "timestamp": "t1"})
+    assert dm.dirty() == {"transactions": set(), "customers": {"1"}}
+    assert sorted(dm.flush()) == sorted([cust_file, trans_file])
+    assert dm.io_stats["files_skipped"] == 7
+
+
+def test_utils_save_json_is_atomic(temp_files, monkeypatch):
+    cust_file, _, _, _ = temp_files
+    original = Utils.load_json(cust_file, {})
+    directory = os.path.dirname(cust_file)
+    before = set(os.listdir(directory))
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr(os, "replace", fail)
+    with pytest.raises(OSError):
+        Utils.save_json(cust_file, {"2": {"name": "Lost"}})
+    assert Utils.load_json(cust_file, {}) == original
+    assert not [f for f in set(os.listdir(directory)) - before if f.startswith(".tmp-")]
+
+
+def test_group_committer_coalesces_saves(temp_files):
+    from utils import GroupCommitter
+    cust_file, _, _, _ = temp_files
+    committer = GroupCommitter(window=60)
+    for i in range(5):
+        committer.save_json(cust_file, {"count": i})
+    assert committer.flush() == [cust_file]
+    assert committer.commits == 1
+    assert committer.coalesced == 4
+    assert Utils.load_json(cust_file, {}) == {"count": 4}
+
+
+def test_save_dashboard_writes_figures_at_commit(temp_files, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # the dashboard file is written to the working directory
+    cust_file, trans_file, cred_file, _ = temp_files
+    dm = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                     credentials_file=cred_file, journal_file=str(tmp_path / "journal.jsonl"),
+                     group_commit_window=60)
+    dm.add_transaction({"customer_id": "1", "amount": 20000.0, "timestamp": "t1"})
+    assert dm.save_dashboard() == ["dashboard_data.json"]
+    assert dm.save_dashboard() == []
+    dm.add_transaction({"customer_id": "1", "amount": 5.0, "timestamp": "t2"})
+    dm.save_dashboard()
+    assert not os.path.exists("dashboard_data.json")  # pending until the group commit
+    dm.close()
+    saved = Utils.load_json("dashboard_data.json", {})
+    assert (saved["count"], saved["total"], saved["per_customer"]) == (3, 20105.0, {"1": 20105.0})
+
+
+def test_audit_logger_buffers_and_migrates(temp_files):
+    _, _, _, audit_file = temp_files
+    with open(audit_file, "w") as f:
+        json.dump([{"action": "Old action", "timestamp": "2025-01-01 00:00:00"}], f)
+
+    logger = AuditLogger(audit_file=audit_file, buffer_size=10, flush_interval=60)
+    with open(audit_file) as f:
+        assert json.loads(f.readline())["action"] == "Old action"
+
+    logger.add("Buffered action")
+    assert [e["action"] for e in logger.get_log()] == ["Old action", "Buffered action"]
+    assert len(AuditLogger(audit_file=audit_file).get_log()) == 1
+
+    logger.close()
+    assert len(AuditLogger(audit_file=audit_file).get_log()) == 2
+
+
+def test_audit_logger_rotation_and_range_reads(temp_files):
+    _, _, _, audit_file = temp_files
+    logger = AuditLogger(audit_file=audit_file, max_segment_bytes=1)
+    logger.SPARSE_EVERY = 2
+    for day in range(1, 6):
+        logger._buffer.append({"action": f"day {day}", "timestamp": f"2025-01-0{day} 12:00:00"})
+        logger.flush()
+
+    assert len(logger.segments) == 4
+    assert [e["action"] for e in logger.get_log()] == [f"day {d}" for d in range(1, 6)]
+    in_range = logger.read_range("2025-01-02 00:00:00", "2025-01-03 23:59:59")
+    assert [e["action"] for e in in_range] == ["day 2", "day 3"]
+
+    reopened = AuditLogger(audit_file=audit_file)
+    assert len(reopened.read_range(start="2025-01-05")) == 1
+    for segment in reopened.segments:
+        os.unlink(segment["file"])
+    os.unlink(reopened.index_file)
+
+
+def test_data_manager_transaction_index(temp_files):
+    cust_file, trans_file, cred_file, _ = temp_files
+    dm = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                     credentials_file=cred_file)
+    dm.add_transaction({"customer_id": "1", "amount": 5.0, "timestamp": "t1"})
+    txn = dm.find_transaction("1", "t1")
+    assert dm.get_transaction(txn["id"]) is txn
+    assert dm.customer_history("1")[-1] is txn
+
+    assert dm.update_transaction("1", "t1", 9.0)
+    assert dm.customer_history("1")[-1]["amount"] == 9.0
+
+    transactions = dm.transactions
+    assert dm.delete_transaction("1", "t1")
+    assert dm.transactions is transactions
+    assert dm.find_transaction("1", "t1") is None
+    assert dm.customer_history("1") == []
+    assert not dm.delete_transaction("1", "t1")
+
+
+def test_data_manager_staff_index(temp_files):
+    cust_file, trans_file, cred_file, _ = temp_files
+    dm = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                     credentials_file=cred_file)
+    dm.add_transaction({"customer_id": "1", "amount": 5.0, "timestamp": "t1", "staff_username": "ali"})
+    dm.add_transaction({"customer_id": "1", "amount": 6.0, "timestamp": "t2", "staff_username": "sara"})
+    dm.add_transaction({"customer_id": "1", "amount": 7.0, "timestamp": "t3", "staff_username": "ali"})
+    assert [t["amount"] for t in dm.transactions_for_staff("ali")] == [5.0, 7.0]
+
+    dm.delete_transaction("1", "t1")
+    assert [t["amount"] for t in dm.transactions_for_staff("ali")] == [7.0]
+    assert dm.transactions_for_staff("nobody") == []
+
+
+def test_data_manager_migrates_duplicated_history(temp_files):
+    cust_file, trans_file, cred_file, _ = temp_files
+    txn = {"customer_id": "1", "amount": 100.0, "timestamp": "t1"}
+    orphan = {"customer_id": "1", "amount": 30.0, "timestamp": "t2"}
+    Utils.save_json(trans_file, [txn])
+    Utils.save_json(cust_file, {"1": {"name": "Test Customer", "history": [txn, orphan]}})
+
+    dm = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                     credentials_file=cred_file)
+    dm.flush()
+    saved = Utils.load_json(cust_file, {})["1"]
+    assert "history" not in saved
+    assert len(saved["txn_ids"]) == 2
+    assert [t["amount"] for t in dm.customer_history("1")] == [100.0, 30.0]
+    assert len(Utils.load_json(trans_file, [])) == 2
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_columnar_ledger_tracks_data_manager(temp_files, monkeypatch, use_numpy):
+    import columnar
+    if not use_numpy:
+        monkeypatch.setattr(columnar, "_numpy", lambda: None)
+    elif columnar._numpy() is None:
+        pytest.skip("numpy not installed")
+    cust_file, trans_file, cred_file, _ = temp_files
+    dm = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                     credentials_file=cred_file)
+    dm.add_customer("2", {"name": "Other", "contact": ""})
+    ledger = dm.columnar()
+    dm.add_transaction({"customer_id": "2", "amount": 20000.0,
+                        "timestamp": "2025-05-08 15:38:39.573700", "staff_username": "ali"})
+    snapshot = dm.columnar_snapshot()
+    dm.add_transaction({"customer_id": "1", "amount": 50.0, "timestamp": "t1", "staff_username": "ali"})
+    dm.update_transaction("1", "t1", 60.0)
+    dm.delete_transaction("2", "2025-05-08 15:38:39.573700")
+
+    assert len(ledger) == 2
+    assert ledger.total() == 160.0
+    assert ledger.count_above(10000) == 0
+    assert ledger.totals_by_customer() == {"1": 160.0, "2": 0.0}
+    assert ledger.totals_by_staff() == {"ali": 60.0}
+    assert ledger.totals_by_day()["2025-05-08"] == 0.0
+    assert sum(ledger.histogram(bins=4)[0]) == 2
+    ledger.compact()
+    assert sorted(ledger.amount_values()) == [60.0, 100.0]
+    assert snapshot.total() == 20100.0 and len(snapshot) == 2
+
+
+def test_dashboard_aggregates_stay_current(temp_files):
+    cust_file, trans_file, cred_file, _ = temp_files
+    dm = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                     credentials_file=cred_file)
+    agg = dm.aggregates
+    assert (agg.total, agg.count, agg.suspicious) == (100.0, 1, 0)
+
+    dm.add_transaction({"customer_id": "1", "amount": 15000.0, "timestamp": "t1", "staff_username": "ali"})
+    dm.update_transaction("1", "t1", 20000.0)
+    assert (agg.total, agg.suspicious, agg.staff_total("ali")) == (20100.0, 1, 20000.0)
+    dm.delete_transaction("1", "t1")
+    assert (agg.total, agg.count, agg.suspicious, agg.staff_count("ali")) == (100.0, 1, 0, 0)
+    assert agg.verify(dm.transactions) == {}
+
+    agg.total += 5
+    assert set(agg.verify(dm.transactions, repair=True)) == {"total"}
+    assert agg.verify(dm.transactions) == {}
+
+
+def test_report_job_streams_to_timestamped_file(temp_files, tmp_path):
+    from reports import ReportJob
+    cust_file, trans_file, cred_file, _ = temp_files
+    Utils.save_json(cust_file, {str(i): {"name": f"C{i}", "contact": Utils.encrypt(f"c{i}@x.com")}
+                                for i in range(1, 6)})
+    dm = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                     credentials_file=cred_file)
+    job = ReportJob(dm, out_dir=str(tmp_path))
+    job.PROGRESS_EVERY = 2
+    job.start().join()
+
+    events = []
+    while not job.events.empty():
+        events.append(job.events.get())
+    assert [e[0] for e in events] == ["progress", "progress", "done"]
+    with open(job.path) as f:
+        rows = f.read().splitlines()
+    assert rows[0] == "Customer ID,Name,Contact,Total Transactions"
+    assert rows[1] == "1,C1,c1@x.com,100.0"
+    assert len(rows) == 6
+
+    cancelled = ReportJob(dm, out_dir=str(tmp_path))
+    cancelled.cancel()
+    assert cancelled.run() is None
+    assert cancelled.events.get()[0] == "cancelled"
+    assert os.listdir(tmp_path) == [os.path.basename(job.path)]
+
+    # A row that fails to decrypt stops the report; the partial file is removed
+    dm.customers["3"]["contact"] = "not base64!"
+    failed = ReportJob(dm, out_dir=str(tmp_path))
+    assert failed.run() is None
+    assert failed.events.get()[0] == "error"
+    assert os.listdir(tmp_path) == [os.path.basename(job.path)]
+
+
+def test_batch_reports_merge_partitions(temp_files, tmp_path):
+    import concurrent.futures
+    from reports import run_batch_reports, BATCH_REPORTS
+    cust_file, trans_file, cred_file, _ = temp_files
+    dm = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                     credentials_file=cred_file)
+    for i in range(5):
+        dm.add_transaction({"customer_id": "1", "amount": 20000.0 if i == 3 else 10.0,
+                            "timestamp": f"2025-05-0{i + 1} 10:00:00", "staff_username": "ali"})
+
+    result = run_batch_reports(dm, out_dir=str(tmp_path), workers=2, chunk_size=2)
+    assert result["partitions"] == 3
+    assert set(result["timings"]) == set(BATCH_REPORTS)
+    with open(result["paths"]["customer_totals"]) as f:
+        assert f.read().splitlines()[1] == "1,Test Customer,20140.0,6"
+    with open(result["paths"]["staff_activity"]) as f:
+        assert f.read().splitlines()[1:] == ["ali,20040.0,5"]
+    with open(result["paths"]["daily_volumes"]) as f:
+        assert len(f.read().splitlines()) == 6
+    with open(result["paths"]["suspicious"]) as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 2 and lines[1].endswith(",threshold")
+
+    # Concurrent runs over different ledgers don't see each other's data
+    other = DataManager(customers_file=cust_file, transactions_file=str(tmp_path / "none.json"),
+                        credentials_file=cred_file)
+    with concurrent.futures.ThreadPoolExecutor(2) as threads:
+        runs = [threads.submit(run_batch_reports, store, str(tmp_path / name), 1)
+                for store, name in ((dm, "a"), (other, "b")) for _ in range(2)]
+        results = [run.result() for run in runs]
+    for result, expected in zip(results, ["20140.0,6", "20140.0,6", None, None]):
+        with open(result["paths"]["customer_totals"]) as f:
+            rows = f.read().splitlines()[1:]
+        assert rows == ([f"1,Test Customer,{expected}"] if expected else [])
+
+
+def test_row_window_fetches_only_visible_rows():
+    from widgets import RowWindow
+    fetched = []
+
+    def fetch(key):
+        fetched.append(key)
+        return (key, Utils.decrypt(Utils.encrypt(f"contact {key}")))
+
+    rows = RowWindow(range(10000), fetch, buffer=5)
+    visible = rows.window(100, 20)
+    assert [key for key, _ in visible] == list(range(100, 120))
+    assert visible[0][1] == (100, "contact 100")
+    assert len(fetched) == 30
+
+    # Scrolling within the buffer reuses cached rows
+    rows.window(103, 20)
+    assert len(fetched) == 33
+    assert rows.clamp(20000, 20) == 9980
+
+    rows.sort(lambda key: -key)
+    assert [key for key, _ in rows.window(0, 3)] == [9999, 9998, 9997]
+
+
+def test_audit_logger_paged_query(temp_files):
+    _, _, _, audit_file = temp_files
+    logger = AuditLogger(audit_file=audit_file, max_segment_bytes=200)
+    for i in range(10):
+        user = "ali" if i % 2 else "sara"
+        logger._buffer.append({"action": f"Action {i}", "timestamp": f"2025-01-01 00:00:0{i}",
+                               "username": user})
+        logger.flush()
+    logger._buffer.append({"action": "Legacy entry by ali", "timestamp": "2025-01-01 00:00:10"})
+    assert len(logger.segments) > 1
+
+    page, cursor = logger.query(limit=4)
+    assert [e["action"] for e in page] == ["Legacy entry by ali", "Action 9", "Action 8", "Action 7"]
+    page, cursor = logger.query(limit=4, cursor=cursor)
+    assert [e["action"] for e in page] == ["Action 6", "Action 5", "Action 4", "Action 3"]
+    page, cursor = logger.query(limit=4, cursor=cursor)
+    assert [e["action"] for e in page] == ["Action 2", "Action 1", "Action 0"]
+    assert cursor is None
+
+    page, _ = logger.query(username="ali", start="2025-01-01 00:00:03", end="2025-01-01 00:00:07")
+    assert [e["action"] for e in page] == ["Action 7", "Action 5", "Action 3"]
+    assert [e["action"] for e in logger.query(username="ali", text="LEGACY")[0]] == ["Legacy entry by ali"]
+    for segment in logger.segments:
+        os.unlink(segment["file"])
+    os.unlink(logger.index_file)
+
+
+def test_persistence_executor_runs_tasks_in_order():
+    from persistence import PersistenceExecutor
+    executor = PersistenceExecutor()
+    ran, done, errors = [], [], []
+    for i in range(5):
+        executor.submit(lambda i=i: ran.append(i) or i, on_done=done.append)
+
+    def fail():
+        raise OSError("disk full")
+    executor.error_handler = errors.append
+    executor.submit(fail)
+
+    assert executor.wait(timeout=5)
+    assert executor.pending() == 0
+    assert ran == [0, 1, 2, 3, 4]
+    # Callbacks only run when dispatched from the Tk thread's poll
+    assert done == []
+    executor.shutdown(timeout=5)
+    assert done == [0, 1, 2, 3, 4]
+    assert isinstance(errors[0], OSError)
+
+
+def test_data_manager_lazy_loading(temp_files):
+    cust_file, trans_file, cred_file, _ = temp_files
+    journal = cust_file + ".journal"
+    dm = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                     credentials_file=cred_file, journal_file=journal)
+    dm.set_credential("staff", Utils.encrypt("pw"))
+    dm.close()
+
+    lazy = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                       credentials_file=cred_file, journal_file=journal, lazy=True)
+    # Credentials, including ones still in the journal, are available at once
+    assert set(lazy.credentials) == {"admin", "staff"}
+    assert not lazy.is_loaded()
+    lazy.load_async()
+    assert len(lazy.transactions) == 1
+    assert lazy.is_loaded()
+    assert lazy.aggregates.total == 100.0
+    lazy.close()
+
+    # Index lookups and mutations wait for the load too
+    lazy = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                       credentials_file=cred_file, journal_file=journal, lazy=True)
+    assert lazy.transactions_for_staff("staff") == []
+    assert not lazy.update_transaction("1", "missing", 5.0)
+    lazy.close()
+
+    # A failed load keeps failing instead of exposing half-loaded stores
+    with open(trans_file, "w") as f:
+        f.write('[{"customer_id": "1", "amount": ')
+    broken = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                         credentials_file=cred_file, journal_file=journal, lazy=True)
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            broken.ensure_loaded()
+    with pytest.raises(ValueError):
+        broken.aggregates
+    with pytest.raises(ValueError):
+        broken.delete_transaction("1", None)
+    for f in [journal, journal + ".seq"]:
+        if os.path.exists(f):
+            os.unlink(f)
+
+
+def test_amount_histogram_updates_incrementally(temp_files, monkeypatch):
+    from histogram import AmountHistogram
+    cust_file, trans_file, cred_file, _ = temp_files
+    dm = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                     credentials_file=cred_file)
+    dm.add_transaction({"customer_id": "1", "amount": 0.0, "timestamp": "t0"})
+    histogram = dm.histogram(bins=4, background=False)
+    assert histogram.edges == [0.0, 25.0, 50.0, 75.0, 100.0]
+    assert histogram.counts == [1, 0, 0, 1]
+
+    dm.add_transaction({"customer_id": "1", "amount": 30.0, "timestamp": "t1"})
+    dm.update_transaction("1", "t1", 60.0)
+    assert histogram.counts == [1, 0, 1, 1]
+    dm.add_transaction({"customer_id": "1", "amount": 500.0, "timestamp": "t2"})
+    assert histogram.overflow == 1
+
+    # Out-of-range amounts trigger a rebin from the full data on a background
+    # thread; the current histogram is served until it is done
+    assert dm.histogram(bins=4) is histogram
+    dm._rebin_thread.join()
+    assert not dm.histogram_pending()
+    histogram = dm.histogram(bins=4)
+    assert histogram.edges[-1] == 500.0
+    assert histogram.total() == 4 and not histogram.needs_rebin()
+    dm.delete_transaction("1", "t2")
+    assert histogram.counts == [3, 0, 0, 0]
+
+    # A change made while the new bins are computed is not lost
+    build = AmountHistogram.from_amounts
+    def build_during_change(amounts, bins, scale):
+        dm.add_transaction({"customer_id": "1", "amount": 70.0, "timestamp": "t3"})
+        return build(amounts, bins, scale)
+    monkeypatch.setattr(AmountHistogram, "from_amounts", build_during_change)
+    dm._rebin(2, "linear")
+    monkeypatch.undo()
+    assert dm.histogram(bins=2).total() == 4
+
+    log_hist = AmountHistogram.from_amounts([1, 10, 100, 1000, -5], bins=3, scale="log")
+    assert log_hist.counts == [1, 1, 2] and log_hist.underflow == 1
+
+
+def test_chart_manager_reuses_figure():
+    pytest.importorskip("matplotlib")
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from charts import ChartManager
+    charts = ChartManager(canvas_factory=FigureCanvasAgg)
+    panel = charts.panel("distribution", None)
+    assert charts.panel("distribution", None) is panel
+
+    assert charts.update_bars("distribution", [0, 10], [10, 10], [3, 1])
+    bars = panel.artists
+    # Unchanged data is not redrawn; changed counts move the same rectangles
+    assert not charts.update_bars("distribution", [0, 10], [10, 10], [3, 1])
+    assert charts.update_bars("distribution", [0, 10], [10, 10], [3, 2])
+    assert panel.artists is bars and bars[1].get_height() == 2
+    assert panel.draws == 2 and len(panel.ax.patches) == 2
+
+    charts.panel("breakdown", None)
+    assert charts.update_pie("breakdown", [5.0], ["Transactions"], ["#3498db"])
+    assert not charts.update_pie("breakdown", [5.0], ["Transactions"], ["#3498db"])
+
+
+def test_sqlite_backend_imports_and_persists(temp_files, tmp_path):
+    from sqlite_store import SQLiteDataManager, import_json
+    cust_file, trans_file, cred_file, _ = temp_files
+    db_file = str(tmp_path / "finsecure.db")
+    counts = import_json(db_file, cust_file, trans_file, cred_file)
+    assert counts == {"customers": 1, "transactions": 1, "credentials": 1}
+
+    dm = SQLiteDataManager(db_file)
+    assert "admin" in dm.credentials and "1" in dm.customers
+    assert dm.customers["1"]["name"] == "Test Customer"
+    assert dm.aggregates.total == 100.0
+    dm.add_customer("2", {"name": "Other", "contact": "x", "is_staff": False, "username": None})
+    dm.add_transaction({"customer_id": "2", "amount": 20000.0, "timestamp": "t1",
+                        "staff_username": "alice"})
+    assert not dm.add_transaction({"customer_id": "9", "amount": 1.0})
+    assert dm.update_transaction("2", "t1", 50.0)
+    assert dm.flush() == [db_file]
+    assert dm.flush() == []
+    dm.close()
+
+    # Reopened from disk, the views and indexes agree with the running totals
+    dm = SQLiteDataManager(db_file)
+    assert len(dm.transactions) == 2 and dm.transactions[-1]["amount"] == 50.0
+    assert [t["amount"] for t in dm.transactions_for_staff("alice")] == [50.0]
+    assert dm.customers["2"]["txn_ids"] == [dm.find_transaction("2", "t1")["id"]]
+    assert dm.aggregates.verify(list(dm.transactions)) == {}
+    assert sorted(dm.amounts()) == [50.0, 100.0] and dm.histogram().total() == 2
+    assert dm.delete_transaction("2", "t1")
+    assert dm.customer_history("2") == [] and dm.aggregates.staff_count("alice") == 0
+    dm.close()
+
+
+def test_sqlite_open_backfills_fraud_from_columns(temp_files, tmp_path, monkeypatch):
+    from sqlite_store import SQLiteDataManager, _TransactionsView, import_json
+    cust_file, trans_file, cred_file, _ = temp_files
+    db_file = str(tmp_path / "finsecure.db")
+    import_json(db_file, cust_file, trans_file, cred_file)
+    dm = SQLiteDataManager(db_file)
+    big = {"customer_id": "1", "amount": 20000.0, "timestamp": "2025-05-08 10:00:00"}
+    dm.add_transaction(big)
+    dm.close()
+
+    # The open pages through flat columns and never builds the records
+    monkeypatch.setattr(SQLiteDataManager, "BATCH", 1)
+    monkeypatch.setattr(_TransactionsView, "__iter__", lambda self: pytest.fail("records built"))
+    dm = SQLiteDataManager(db_file)
+    assert dm.fraud().flags == {big["id"]: ["threshold"]}
+    assert len(dm.columnar()) == 2 and dm.columnar().totals_by_day()["2025-05-08"] == 20000.0
+    dm.close()
+
+
+def test_sqlite_import_includes_journal_and_snapshot(temp_files, tmp_path):
+    from sqlite_store import SQLiteDataManager, import_json
+    cust_file, trans_file, cred_file, _ = temp_files
+    journal, snap_file = str(tmp_path / "journal.jsonl"), str(tmp_path / "finsecure.snap")
+    dm = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                     credentials_file=cred_file, journal_file=journal, snapshot_file=snap_file)
+    dm.add_transaction({"customer_id": "1", "amount": 5.0, "timestamp": "t1"})
+    dm.set_credential("staff", Utils.encrypt("pw"))
+    dm.close()  # the records stay in the journal, not yet compacted
+
+    db_file = str(tmp_path / "finsecure.db")
+    counts = import_json(db_file, cust_file, trans_file, cred_file, journal, snap_file)
+    assert counts == {"customers": 1, "transactions": 2, "credentials": 2}
+    store = SQLiteDataManager(db_file)
+    assert "staff" in store.credentials and store.find_transaction("1", "t1")["amount"] == 5.0
+    store.close()
+
+
+def test_streaming_json_loader(temp_files, tmp_path):
+    from json_stream import iter_json, JSONStreamError
+    records = [{"customer_id": str(i), "amount": i * 1.5, "note": "é" * i} for i in range(200)]
+    path = tmp_path / "transactions.json"
+    path.write_text(json.dumps(records, indent=4), encoding="utf-8")
+    # Small chunks force records and multi-byte characters across chunk boundaries
+    assert list(iter_json(str(path), chunk_size=16)) == records
+    assert list(iter_json(str(tmp_path / "missing.json"))) == []
+
+    text = '{"1": {"name": "A"}, "2": {"name": B}}'
+    path.write_text(text)
+    seen = []
+    with pytest.raises(JSONStreamError) as error:
+        for item in iter_json(str(path), chunk_size=8):
+            seen.append(item)
+    assert seen == [("1", {"name": "A"})]
+    assert text[error.value.offset:].startswith('{"name": B}')
+
+    # DataManager refuses a corrupt store instead of loading it as empty
+    cust_file, _, cred_file, _ = temp_files
+    with pytest.raises(JSONStreamError):
+        DataManager(customers_file=cust_file, transactions_file=str(path),
+                    credentials_file=cred_file)
+
+
+def test_binary_snapshot_round_trip(temp_files, tmp_path):
+    import snapshot
+    cust_file, trans_file, cred_file, _ = temp_files
+    snap_file = str(tmp_path / "finsecure.snap")
+    assert snapshot.import_json(snap_file, cust_file, trans_file) == (1, 1)
+
+    dm = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                     credentials_file=cred_file, snapshot_file=snap_file)
+    dm.add_customer("2", {"name": "Staff", "contact": "s", "is_staff": True, "username": "bob"})
+    dm.add_transaction({"customer_id": "2", "amount": 12.5, "timestamp": "t1",
+                        "staff_username": "bob", "note": {"ref": 7}})
+    assert dm.flush() == [snap_file]
+    before = Utils.load_json(trans_file, [])
+
+    reopened = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                           credentials_file=cred_file, snapshot_file=snap_file)
+    assert reopened.customers == dm.customers
+    assert reopened.transactions == dm.transactions
+    assert reopened.transactions_for_staff("bob")[0]["note"] == {"ref": 7}
+    # The JSON files are untouched until exported
+    assert Utils.load_json(trans_file, []) == before
+    snapshot.export_json(snap_file, cust_file, trans_file)
+    assert Utils.load_json(trans_file, []) == dm.transactions
+    timings = snapshot.benchmark(snap_file, cust_file, trans_file, repeat=1)
+    assert set(timings) == {"json.load", "json stream", "snapshot"}
+
+    with open(snap_file, "r+b") as file:
+        file.write(b"XXXX")
+    with pytest.raises(snapshot.SnapshotError):
+        snapshot.load(snap_file)
+
+
+def test_bulk_import_batches(temp_files, tmp_path, monkeypatch):
+    from bulk_import import BulkImporter
+    monkeypatch.chdir(tmp_path)  # the dashboard file is written to the working directory
+    cust_file, trans_file, cred_file, _ = temp_files
+    journal = str(tmp_path / "journal.jsonl")
+    dm = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                     credentials_file=cred_file, journal_file=journal)
+    logger = AuditLogger(audit_file=str(tmp_path / "audit.jsonl"))
+    source = tmp_path / "ledger.csv"
+    source.write_text("customer_id,amount,timestamp\n"
+                      "1,50,2024-01-01\n"
+                      "9,10,2024-01-02\n"
+                      "1,abc,2024-01-03\n"
+                      "1,25000,2024-01-04\n"
+                      "1,-5,2024-01-05\n")
+
+    result = BulkImporter(dm, logger, "admin", batch_size=2).run(str(source))
+    assert (result["rows"], result["imported"], result["rejected"]) == (5, 3, 2)
+    assert result["suspicious"] == 1 and result["batches"] == 3
+    assert [line for line, _ in result["errors"]] == [3, 4]
+    assert result["rows_per_sec"] > 0
+    # One journal record and one audit entry per batch
+    with open(journal) as file:
+        assert len(file.readlines()) == 3
+    assert len(logger.get_log()) == 3
+    assert dm.aggregates.suspicious == 1 and len(dm.customer_history("1")) == 3
+    dm.close()
+
+    replayed = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                           credentials_file=cred_file, journal_file=journal)
+    assert len(replayed.transactions) == 4
+    replayed.close()
+
+
+def test_service_runs_without_gui(temp_files, tmp_path, monkeypatch):
+    from service import FinSecureService, ServiceError
+    monkeypatch.chdir(tmp_path)
+    cust_file, trans_file, cred_file, _ = temp_files
+    Utils.save_json(cust_file, {})  # the fixture's contact is not encrypted
+    dm = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                     credentials_file=cred_file)
+    logger = AuditLogger(audit_file=str(tmp_path / "audit.jsonl"))
+    service = FinSecureService(dm, logger)
+    assert service.authenticate("admin", "wrong") is None
+    assert service.authenticate("admin", "admin123") == "admin"
+
+    cid = service.add_customer("Bob", "bob@example.com", "bob", "pw")
+    with pytest.raises(ServiceError, match="already exists"):
+        service.add_customer("Bob", "bob@example.com", "bob", "pw")
+    txn, suspicious = service.add_transaction(cid, "20000")
+    assert suspicious and service.stats()["suspicious"] == 1
+    with pytest.raises(ServiceError, match="Invalid amount"):
+        service.add_transaction(cid, "abc")
+    service.edit_transaction(cid, txn["timestamp"], "50")
+    assert service.commit() == ["Customer added: Bob (staff account)",
+                                f"Transaction added for customer {cid}: 20000.0 by admin"]
+    assert service.generate_report(str(tmp_path / "reports")).endswith(".csv")
+    service.commit()
+    assert [e["action"] for e in service.audit_log(limit=1)[0]] == ["Admin generated report"]
+
+    staff = FinSecureService(dm, logger)
+    assert staff.authenticate("bob", "pw") == "staff"
+    with pytest.raises(ServiceError):
+        staff.report_job()
+    staff.delete_transaction(cid, txn["timestamp"])
+    assert staff.stats() == {"count": 0, "total": 0.0, "recent": 0}
+    staff.commit()
+    dm.close()
+    logger.close()
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_fraud_rules_stream_and_backfill(temp_files, monkeypatch, use_numpy):
+    import columnar
+    from columnar import ColumnarLedger
+    from fraud_rules import FraudEngine
+    if not use_numpy:
+        monkeypatch.setattr(columnar, "_numpy", lambda: None)
+    elif columnar._numpy() is None:
+        pytest.skip("numpy not installed")
+
+    def txn(txn_id, cid, amount, ts=None):
+        record = {"id": txn_id, "customer_id": cid, "amount": amount}
+        if ts:
+            record["timestamp"] = ts
+        return record
+
+    ledger = [txn(f"a{i}", "a", 100.0, f"2024-01-01 10:{i:02d}:00") for i in range(1, 8)]
+    ledger += [txn("a8", "a", 5000.0, "2024-01-02 10:00:00"),
+               txn("c1", "c", 30000.0, "2024-01-01 09:00:00"),
+               txn("b1", "b", 9500.0, "2024-01-01 12:00:00"),
+               txn("c2", "c", 30000.0, "2024-01-01 18:00:00"),
+               txn("b2", "b", 9600.0, "2024-01-03 12:00:00"),
+               txn("d1", "d", 20000.0),
+               txn("b3", "b", 9700.0, "2024-01-05 12:00:00")]
+    expected = {"a6": ["velocity"], "a7": ["velocity"], "a8": ["deviation"],
+                "b3": ["structuring"], "c1": ["threshold"], "c2": ["threshold", "rolling_sum"],
+                "d1": ["threshold"]}
+
+    streaming = FraudEngine()
+    for record in ledger:
+        streaming.on_add(record)
+    assert streaming.flags == expected
+    backfilled = FraudEngine()
+    columns = ColumnarLedger(reversed(ledger))
+    columns.on_add(txn("e1", "e", 90000.0, "2024-01-01 10:00:00"))
+    columns.on_delete({"id": "e1"})
+    assert backfilled.backfill(columns) == len(expected)
+    assert backfilled.flags == expected
+    assert backfilled.counts()["threshold"] == 3
+
+    ledger[8]["amount"] = 50.0
+    streaming.on_update(ledger[8], 30000.0)
+    streaming.on_delete(ledger[10])
+    assert "c1" not in streaming.flags and "c2" not in streaming.flags
+
+    # DataManager scores new transactions against the customer's history
+    cust_file, trans_file, cred_file, _ = temp_files
+    dm = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                     credentials_file=cred_file)
+    for ts in ("2024-01-01", "2024-01-03"):
+        dm.add_transaction({"customer_id": "1", "amount": 9900.0, "timestamp": ts})
+    engine = dm.fraud()
+    added = {"customer_id": "1", "amount": 9950.0, "timestamp": "2024-01-05"}
+    dm.add_transaction(added)
+    assert engine.reasons(added["id"]) == ["structuring"] and len(engine) == 1
+
+
+def test_decrypt_cache(temp_files, tmp_path, monkeypatch):
+    from utils import DecryptCache
+    from service import FinSecureService
+    calls = []
+    cache = DecryptCache(max_size=2, decrypt=lambda c: calls.append(c) or Utils.decrypt(c))
+    a, b = Utils.encrypt("a@example.com"), Utils.encrypt("b@example.com")
+    assert cache.get("1", a) == cache.get("1", a) == "a@example.com"
+    # A changed ciphertext is decrypted again, not served stale
+    assert cache.get("1", b) == "b@example.com"
+    cache.get("2", a)
+    cache.get("3", a)
+    cache.invalidate("3")
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 4, "evictions": 1}
+    assert len(calls) == 4
+
+    monkeypatch.chdir(tmp_path)
+    cust_file, trans_file, cred_file, _ = temp_files
+    Utils.save_json(cust_file, {})
+    dm = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                     credentials_file=cred_file)
+    service = FinSecureService(dm, AuditLogger(audit_file=str(tmp_path / "audit.jsonl")))
+    assert service.authenticate("admin", "admin123") == "admin"
+    cid = service.add_customer("Bob", "bob@example.com")
+    assert service.customer_row(cid) == (cid, "Bob", "bob@example.com")
+    service.generate_report(str(tmp_path / "reports"))
+    assert service.authenticate("admin", "admin123") == "admin"
+    assert (service.secrets.hits, service.secrets.misses) == (2, 2)
+    service.logout()
+    assert len(service.secrets) == 0 and service.role is None
+    dm.close()
+
+
+def test_service_cli_reports_errors(tmp_path, monkeypatch, capsys):
+    from service import main
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("FINSECURE_PASSWORD", "admin123")
+    Utils.save_json("credentials.json", {"admin": Utils.encrypt("admin123")})
+    Utils.save_json("customers.json", {})
+    Utils.save_json("transactions.json", [])
+    assert main(["--user", "admin", "import", "missing.csv"]) == 1
+    assert "Import failed" in capsys.readouterr().err
+    assert main(["--user", "admin", "import", "ledger.xml"]) == 1
+    assert "unsupported import format" in capsys.readouterr().err
+
+    with open("transactions.json", "w") as f:
+        f.write('[{"customer_id": "1", "amount": ')
+    assert main(["--user", "admin", "stats"]) == 1
+    assert "Could not load the data files" in capsys.readouterr().err
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_transactions_sharing_a_timestamp(temp_files, tmp_path, backend):
+    # Bulk-imported daily rows share (customer_id, timestamp)
+    from sqlite_store import SQLiteDataManager, import_json
+    cust_file, trans_file, cred_file, _ = temp_files
+    if backend == "json":
+        dm = DataManager(customers_file=cust_file, transactions_file=trans_file,
+                         credentials_file=cred_file)
+    else:
+        import_json(str(tmp_path / "finsecure.db"), cust_file, trans_file, cred_file)
+        dm = SQLiteDataManager(str(tmp_path / "finsecure.db"))
+    dm.add_transactions([{"customer_id": "1", "amount": float(i), "timestamp": "2024-01-05"}
+                         for i in (1, 2, 3)])
+    first = dm.find_transactions("1", "2024-01-05")[0]
+    assert dm._apply("delete_transaction", {"id": first["id"]})
+
+    # The rows left under the key can still be edited and deleted
+    assert dm.update_transaction("1", "2024-01-05", 9.0)
+    assert [t["amount"] for t in dm.find_transactions("1", "2024-01-05")] == [9.0, 9.0]
+    assert dm.delete_transaction("1", "2024-01-05")
+    assert not dm.delete_transaction("1", "2024-01-05")
+    assert [t.get("timestamp") for t in dm.transactions] == [None]
+    dm.close()
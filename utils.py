@@ -1,4 +1,5 @@
-import json, os, base64
+import json, os, base64, tempfile, threading, atexit
+from collections import OrderedDict
 
 class Utils:
     @staticmethod
@@ -13,8 +14,46 @@ class Utils:
 
     @staticmethod
     def save_json(filename, data):
-        with open(filename, "w") as file:
-            json.dump(data, file, indent=4)
+        Utils.atomic_write(filename, json.dumps(data, indent=4))
+
+    @staticmethod
+    def atomic_write(filename, text, sync=True):
+        # Write to a temp file in the same directory and rename it over the
+        # target, so a crash leaves either the old or the new file, never a
+        # truncated one.
+        tmp_path = Utils.write_temp(filename, text, sync)
+        try:
+            os.replace(tmp_path, filename)
+        except OSError:
+            os.unlink(tmp_path)
+            raise
+        if sync:
+            Utils.fsync_dir(os.path.dirname(os.path.abspath(filename)))
+
+    @staticmethod
+    def write_temp(filename, text, sync=True):
+        directory = os.path.dirname(os.path.abspath(filename))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+        try:
+            with os.fdopen(fd, "wb" if isinstance(text, bytes) else "w") as file:
+                file.write(text)
+                file.flush()
+                if sync:
+                    os.fsync(file.fileno())
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return tmp_path
+
+    @staticmethod
+    def fsync_dir(directory):
+        if not hasattr(os, "O_DIRECTORY"):
+            return
+        fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
 
     @staticmethod
     def encrypt(data):
@@ -23,3 +62,120 @@ class Utils:
     @staticmethod
     def decrypt(data):
         return base64.b64decode(data.encode()).decode()
+
+
+class DecryptCache:
+    # Bounded LRU cache of decrypted field values. Entries are keyed by a
+    # record id such as ("contact", cid) and remember the ciphertext they were
+    # decrypted from, so a record whose ciphertext changed is decrypted again
+    # rather than served stale. invalidate() drops a record when it is
+    # edited; clear() drops every plaintext on logout (Python strings can't be
+    # overwritten in place, so the cache releases its references instead).
+    def __init__(self, max_size=10000, decrypt=Utils.decrypt):
+        self.max_size = max_size
+        self.decrypt = decrypt
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._values = OrderedDict()  # record id -> (ciphertext, plaintext)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, record_id, ciphertext):
+        with self._lock:
+            entry = self._values.get(record_id)
+            if entry is not None and entry[0] == ciphertext:
+                self._values.move_to_end(record_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        # Decrypted outside the lock so a slow cipher doesn't block other readers
+        value = self.decrypt(ciphertext)
+        with self._lock:
+            self._values[record_id] = (ciphertext, value)
+            self._values.move_to_end(record_id)
+            while len(self._values) > self.max_size:
+                self._values.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def invalidate(self, record_id):
+        with self._lock:
+            self._values.pop(record_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._values), "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions}
+
+
+class GroupCommitter:
+    # Coalesces saves issued within `window` seconds. Repeated saves of the
+    # same file collapse into one write, and every file pending at commit time
+    # is fsynced once before being renamed into place.
+    def __init__(self, window=0.2):
+        self.window = window
+        self.commits = 0
+        self.coalesced = 0
+        self._pending = {}
+        self._files = []
+        self._lock = threading.Lock()
+        self._timer = None
+        atexit.register(self.flush)
+
+    def save_json(self, filename, data):
+        # Serialized when the batch is written, so a save superseded within the
+        # window is never serialized at all. `data` must not be changed after
+        # this call; pass a copy of anything that is still being mutated.
+        self.save(filename, data)
+
+    def save(self, filename, text):
+        # text may be str or bytes, or data to be written as JSON
+        with self._lock:
+            if filename in self._pending:
+                self.coalesced += 1
+            self._pending[filename] = text
+            self._schedule()
+
+    def fsync_later(self, file):
+        with self._lock:
+            if file not in self._files:
+                self._files.append(file)
+            self._schedule()
+
+    def _schedule(self):
+        if self._timer is None:
+            self._timer = threading.Timer(self.window, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            files, self._files = self._files, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not pending and not files:
+                return []
+            temps = [(Utils.write_temp(filename, text if isinstance(text, (str, bytes))
+                                       else json.dumps(text, indent=4)), filename)
+                     for filename, text in pending.items()]
+            directories = set()
+            for tmp_path, filename in temps:
+                os.replace(tmp_path, filename)
+                directories.add(os.path.dirname(os.path.abspath(filename)))
+            for file in files:
+                if not file.closed:
+                    file.flush()
+                    os.fsync(file.fileno())
+            for directory in directories:
+                Utils.fsync_dir(directory)
+            self.commits += 1
+            return list(pending)
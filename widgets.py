@@ -0,0 +1,113 @@
+import tkinter as tk
+from tkinter import ttk
+
+class RowWindow:
+    # The non-Tk half of VirtualTreeview: an ordered list of row keys and a
+    # fetch(key) -> values callback. Rows are fetched only when they fall in
+    # the visible window or its buffer, and cached while they stay near it.
+    def __init__(self, keys, fetch, buffer=20):
+        self.keys = list(keys)
+        self.fetch = fetch
+        self.buffer = buffer
+        self.fetches = 0
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def clamp(self, offset, height):
+        return max(0, min(offset, len(self.keys) - height))
+
+    def window(self, offset, height):
+        start = max(0, offset - self.buffer)
+        end = min(len(self.keys), offset + height + self.buffer)
+        wanted = self.keys[start:end]
+        cache = {}
+        for key in wanted:
+            values = self._cache.get(key)
+            if values is None:
+                values = self.fetch(key)
+                self.fetches += 1
+            cache[key] = values
+        # Only the window and its buffer stay cached
+        self._cache = cache
+        return [(key, cache[key]) for key in self.keys[offset:offset + height]]
+
+    def sort(self, key_func, reverse=False):
+        self.keys.sort(key=key_func, reverse=reverse)
+
+
+class VirtualTreeview(ttk.Frame):
+    # A Treeview that only holds items for the rows currently on screen. The
+    # scrollbar is driven by the row offset rather than by Tk, so opening a
+    # window over tens of thousands of rows creates a few dozen items.
+    # sort_keys maps a column to key_func(row_key); clicking that heading
+    # sorts the key list without fetching rows.
+    def __init__(self, master, columns, keys, fetch, sort_keys=None, buffer=20, row_height=25):
+        super().__init__(master)
+        self.rows = RowWindow(keys, fetch, buffer)
+        self.sort_keys = sort_keys or {}
+        self.row_height = row_height
+        self.offset = 0
+        self.height = 1
+        self._sorted_by = None
+
+        self.scrollbar = ttk.Scrollbar(self, command=self._on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree = ttk.Treeview(self, columns=columns, show='headings')
+        self.tree.pack(fill='both', expand=True)
+
+        for column in columns:
+            if column in self.sort_keys:
+                self.tree.heading(column, text=column, command=lambda c=column: self.sort_by(c))
+            else:
+                self.tree.heading(column, text=column)
+
+        self.tree.bind("<Configure>", self._on_resize)
+        self.tree.bind("<MouseWheel>", lambda e: self.scroll_to(self.offset - e.delta // 120 * 3))
+        self.tree.bind("<Button-4>", lambda e: self.scroll_to(self.offset - 3))
+        self.tree.bind("<Button-5>", lambda e: self.scroll_to(self.offset + 3))
+        self.tree.bind("<Prior>", lambda e: self.scroll_to(self.offset - self.height))
+        self.tree.bind("<Next>", lambda e: self.scroll_to(self.offset + self.height))
+
+    def column(self, *args, **kwargs):
+        self.tree.column(*args, **kwargs)
+
+    def set_keys(self, keys):
+        self.rows = RowWindow(keys, self.rows.fetch, self.rows.buffer)
+        self.scroll_to(0)
+
+    def sort_by(self, column):
+        reverse = self._sorted_by == (column, False)
+        self.rows.sort(self.sort_keys[column], reverse)
+        self._sorted_by = (column, reverse)
+        self.scroll_to(0)
+
+    def scroll_to(self, offset):
+        self.offset = self.rows.clamp(offset, self.height)
+        self.render()
+
+    def render(self):
+        self.tree.delete(*self.tree.get_children())
+        for key, values in self.rows.window(self.offset, self.height):
+            self.tree.insert("", "end", values=values)
+        total = len(self.rows)
+        if total:
+            self.scrollbar.set(self.offset / total, min(1.0, (self.offset + self.height) / total))
+        else:
+            self.scrollbar.set(0, 1)
+
+    def _on_resize(self, event):
+        # Leave room for the heading row
+        height = max(1, event.height // self.row_height - 1)
+        if height != self.height:
+            self.height = height
+            self.scroll_to(self.offset)
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.scroll_to(int(float(amount) * len(self.rows)))
+        elif unit == "pages":
+            self.scroll_to(self.offset + int(amount) * self.height)
+        else:
+            self.scroll_to(self.offset + int(amount))